@@ -4,24 +4,39 @@ import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 import io
+import os
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import hashlib
+import random
+import re
+import threading
+import tempfile
+import zipfile
+import openpyxl
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 # =================================================================
 # 1. KONFIGURASI & CLOUDINARY
 # =================================================================
-try:
-    cloudinary.config( 
-      cloud_name = st.secrets["cloud_name"], 
-      api_key = st.secrets["api_key"], 
-      api_secret = st.secrets["api_secret"],
-      secure = True
-    )
-except:
-    st.error("Konfigurasi Secrets Cloudinary tidak ditemukan!")
+STORAGE_BACKEND = os.environ.get("PARETO_STORAGE", "cloudinary")  # "local" untuk offline/benchmark
+
+if STORAGE_BACKEND == "cloudinary":
+    try:
+        cloudinary.config( 
+          cloud_name = st.secrets["cloud_name"], 
+          api_key = st.secrets["api_key"], 
+          api_secret = st.secrets["api_secret"],
+          secure = True,
+          timeout = 60  # Detik; Admin/Upload API tidak boleh menggantung thread tanpa batas
+        )
+    except:
+        st.error("Konfigurasi Secrets Cloudinary tidak ditemukan!")
 
 st.set_page_config(page_title="Pareto NKL System", layout="wide")
 
@@ -53,36 +68,401 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-USER_DB = "pareto_nkl/config/users_pareto_nkl.json"
+USER_DB = "pareto_nkl/config/users_pareto_nkl.json"   # Format lama (1 file); dibaca sebagai fallback/migrasi
+USER_SHARD_DIR = "pareto_nkl/config/users"
 MASTER_PATH = "pareto_nkl/master_pareto_nkl.xlsx"
+MASTER_SNAPSHOT_DIR = "pareto_nkl/snapshot"  # Snapshot parquet lama (tidak ditulis lagi), hanya dibersihkan
+MASTER_PART_DIR = "pareto_nkl/master"       # Master terpartisi: 1 shard parquet per AM + katalog
+MASTER_CATALOG = f"{MASTER_PART_DIR}/catalog.json"
+MASTER_PART_GRACE_SEC = 600  # Shard yang dilepas katalog baru dihapus setelah ini (pembaca masih memegang katalog lama)
+HASIL_DIR = "pareto_nkl/hasil"
+REKAP_COLS = ['KDTOKO', 'PLU', 'KETERANGAN']
+RESULT_SCHEMA = 1   # Versi format delta hasil input (.json)
+NL_KETERANGAN = "ini item nl!"
+REKAP_STATE_DIR = "pareto_nkl/rekap"
+PROGRESS_DIR = "pareto_nkl/progress"
+REKAP_WORKERS = 8   # Default batas download paralel saat rekap
+PROGRESS_REFRESH_SEC = 15  # Interval thread latar menyegarkan snapshot progres HOME
+PROGRESS_IDLE_SEC = 300    # Berhenti menyegarkan jika tidak ada pengunjung selama ini
+PROGRESS_FAIL_BACKOFF_SEC = 30  # Setelah refresh gagal, render HOME tidak menghitung sinkron selama ini
+PERF_BUFFER_SIZE = 5000    # Jumlah event latensi terakhir yang disimpan di memori
+HTTP_TIMEOUT = (5, 30)      # (connect, read) detik untuk semua download
+HTTP_RETRIES = 4            # Retry untuk 429/5xx & koneksi putus
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+HTTP_BACKOFF = (0.5, 8.0)   # (dasar, batas) detik exponential backoff
+REKAP_CHUNK_ROWS = 20000    # Baris master per potongan saat export rekap (batas memori)
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "pareto_nkl_export")
+EXPORT_KEEP = 4             # Jumlah file export rekap terakhir yang disimpan di disk
+DELETE_BATCH = 100          # Admin API: maks 100 id per delete_resources
+DELETE_WORKERS = 4          # Batch hapus yang berjalan paralel
+SAVE_WORKERS = 4            # Thread upload write-behind "Simpan Hasil Input"
+SAVE_RETRIES = 5            # Retry upload hasil sebelum status 'gagal'
+SAVE_BACKOFF = (1.0, 30.0)  # (dasar, batas) detik backoff retry upload hasil
+SAVE_POLL_SEC = 2           # Interval halaman mengecek status simpan di latar
+USER_SHARD_LEN = 2          # Shard user per N karakter awal NIK
+USER_INDEX_TTL = 300        # Detik shard user di index proses dianggap segar
 
 # =================================================================
-# 2. FUNGSI CORE & ANTI-CACHE (VERSI 470+ BARIS)
+# 2. INSTRUMENTASI & STORAGE BACKEND (CLOUDINARY / FOLDER LOKAL)
 # =================================================================
 
-def clear_all_caches():
-    """Fungsi Inti: Bersihkan cache memori & session state secara agresif"""
-    st.cache_data.clear()
-    keys_to_delete = [k for k in st.session_state.keys() if any(x in k for x in ['ed_', 'result', 'data_toko', 'hash', 'user_db'])]
-    for key in keys_to_delete:
-        del st.session_state[key]
+class PerfRecorder:
+    """Ring buffer latensi per operasi I/O & pandas (ukuran tetap, thread-safe, 1 per proses)"""
 
-def get_user_db_safe():
-    """KOMPENSASI: Retry Logic 3x untuk cegah Database User Error saat login"""
-    if 'user_db_cache' in st.session_state:
-        return st.session_state.user_db_cache
-    
-    url_user = f"https://res.cloudinary.com/{st.secrets['cloud_name']}/raw/upload/v1/{USER_DB}?t={int(time.time())}"
-    for i in range(3):
+    def __init__(self, size=PERF_BUFFER_SIZE):
+        self._events = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, op, sec, nbytes=0, error=None):
+        with self._lock:
+            self._events.append((time.time(), op, sec, nbytes or 0, error))
+
+    @contextmanager
+    def span(self, op, nbytes=0):
+        """Catat durasi blok; info['bytes'] boleh diisi di dalam blok, exception dicatat sebagai error"""
+        info, error, t0 = {'bytes': nbytes}, None, time.perf_counter()
         try:
-            resp = requests.get(url_user, timeout=10)
-            if resp.status_code == 200:
-                db = resp.json()
-                st.session_state.user_db_cache = db
-                return db
-        except:
-            time.sleep(1)
-    return None
+            yield info
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(op, time.perf_counter() - t0, info['bytes'], error)
+
+    def events(self):
+        with self._lock:
+            return pd.DataFrame(list(self._events), columns=['ts', 'op', 'sec', 'bytes', 'error'])
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def summary(self):
+        """count, p50/p95/max (ms), total bytes & jumlah error per operasi"""
+        ev = self.events()
+        if ev.empty:
+            return pd.DataFrame(columns=['op', 'count', 'p50_ms', 'p95_ms', 'max_ms', 'bytes', 'errors'])
+        g = ev.groupby('op')
+        out = pd.DataFrame({
+            'count': g.size(),
+            'p50_ms': g['sec'].quantile(0.5) * 1000,
+            'p95_ms': g['sec'].quantile(0.95) * 1000,
+            'max_ms': g['sec'].max() * 1000,
+            'bytes': g['bytes'].sum(),
+            'errors': g['error'].count(),
+        }).reset_index()
+        return out.sort_values('p95_ms', ascending=False)
+
+    def export_json(self, **extra):
+        ev = self.events()
+        ev['ts'] = pd.to_datetime(ev['ts'], unit='s').dt.strftime('%Y-%m-%dT%H:%M:%S.%f')
+        return json.dumps({
+            'exported_at': datetime.now().isoformat(timespec='seconds'), **extra,
+            'summary': self.summary().round(3).to_dict('records'),
+            'events': ev.to_dict('records'),
+        }, default=str, indent=1)
+
+@st.cache_resource
+def get_perf_recorder():
+    return PerfRecorder()
+
+# Objek 1 proses; referensi global agar thread latar/pool bisa mencatat tanpa konteks Streamlit
+PERF = get_perf_recorder()
+
+def trace(op, nbytes=0):
+    return PERF.span(op, nbytes)
+
+def make_http_session():
+    """requests.Session dengan pool keep-alive: koneksi TLS dipakai ulang antar download"""
+    sess = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
+
+def http_get(session, url, headers=None, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES):
+    """GET dengan timeout konsisten + retry 429/5xx/koneksi putus (exponential backoff + jitter)"""
+    for i in range(retries + 1):
+        wait = 0.0
+        try:
+            resp = session.get(url, headers=headers, timeout=timeout)
+            if resp.status_code not in HTTP_RETRY_STATUS or i == retries: return resp
+            PERF.record("http.retry", 0, error=f"HTTP {resp.status_code}")
+            try: wait = float(resp.headers.get('Retry-After', 0))
+            except ValueError: pass
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if i == retries: raise
+            PERF.record("http.retry", 0, error=type(e).__name__)
+        base, cap = HTTP_BACKOFF
+        time.sleep(max(min(wait, cap), random.uniform(0, min(cap, base * 2 ** i))))  # Full jitter, Retry-After dibatasi cap
+
+# Penanda hasil GET kondisional: isi file sama dengan etag yang dikirim. Sengaja string (bukan object()):
+# backend di-cache lintas rerun, jadi identitas objek penanda dari rerun lain tidak bisa dibandingkan
+NOT_MODIFIED = "not_modified"
+
+class StorageBackend:
+    """Interface storage: semua I/O master, hasil & user DB lewat sini.
+    Path = public_id Cloudinary (termasuk ekstensi). stat/list mengembalikan
+    dict {'path', 'version', 'etag', 'bytes', 'created_at'}."""
+
+    def get(self, path, version=None, fresh=False):
+        """Isi file (bytes) atau None jika tidak ada"""
+        raise NotImplementedError
+
+    def get_if_changed(self, path, etag=None):
+        """GET kondisional 1 round-trip: (bytes, etag) | (NOT_MODIFIED, etag) | (None, None) jika tidak ada"""
+        raise NotImplementedError
+
+    def put(self, path, data):
+        """Tulis/timpa file, kembalikan stat file baru"""
+        raise NotImplementedError
+
+    def create(self, path, data):
+        """Tulis file HANYA jika belum ada (atomik di sisi storage): stat file baru, atau None jika sudah ada"""
+        raise NotImplementedError
+
+    def stat(self, path):
+        """Metadata file atau None jika tidak ada"""
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """Semua file dengan awalan path (lengkap, tanpa batas halaman)"""
+        raise NotImplementedError
+
+    def delete(self, paths):
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        self.delete([f['path'] for f in self.list(prefix)])
+
+
+class CloudinaryStorage(StorageBackend):
+    """Produksi: Admin API untuk stat/list/delete, CDN res.cloudinary.com untuk download"""
+
+    def __init__(self, cloud_name):
+        self.cloud_name = cloud_name
+        self.http = make_http_session()  # Dipakai bersama semua sesi & thread di proses ini
+
+    @staticmethod
+    def _meta(res):
+        return {'path': res['public_id'], 'version': res.get('version'), 'etag': res.get('etag'),
+                'bytes': res.get('bytes'), 'created_at': res.get('created_at')}
+
+    def get(self, path, version=None, fresh=False):
+        # version di URL = bypass cache CDN tanpa cache-buster; fresh = paksa ambil dari origin
+        url = f"https://res.cloudinary.com/{self.cloud_name}/raw/upload/v{version or 1}/{path}"
+        if fresh: url += f"?t={int(time.time())}"
+        resp = http_get(self.http, url)
+        if resp.status_code == 404: return None
+        resp.raise_for_status()
+        return resp.content
+
+    def get_if_changed(self, path, etag=None):
+        # Cache-buster tetap dipakai (lewati CDN), tapi origin cukup balas 304 jika etag sama
+        url = f"https://res.cloudinary.com/{self.cloud_name}/raw/upload/v1/{path}?t={int(time.time())}"
+        resp = http_get(self.http, url, headers={'If-None-Match': f'"{etag}"'} if etag else None)
+        if resp.status_code == 304: return NOT_MODIFIED, etag
+        if resp.status_code == 404: return None, None
+        resp.raise_for_status()
+        return resp.content, resp.headers.get('ETag', '').strip('"') or None
+
+    def put(self, path, data):
+        res = cloudinary.uploader.upload(io.BytesIO(data), resource_type="raw", public_id=path, overwrite=True, invalidate=True)
+        return self._meta(res)
+
+    def create(self, path, data):
+        # overwrite=False: jika public_id sudah ada Cloudinary tidak menimpa dan membalas existing=true
+        res = cloudinary.uploader.upload(io.BytesIO(data), resource_type="raw", public_id=path, overwrite=False)
+        return None if res.get('existing') else self._meta(res)
+
+    def stat(self, path):
+        try: return self._meta(cloudinary.api.resource(path, resource_type="raw"))
+        except cloudinary.exceptions.NotFound: return None
+
+    def list(self, prefix):
+        # Ikuti next_cursor: listing tidak terpotong di 500 file
+        out, cursor = [], None
+        while True:
+            kw = {'next_cursor': cursor} if cursor else {}
+            res = cloudinary.api.resources(resource_type="raw", type="upload", prefix=prefix, max_results=500, **kw)
+            out.extend(self._meta(r) for r in res.get('resources', []))
+            cursor = res.get('next_cursor')
+            if not cursor: return out
+
+    def delete(self, paths):
+        paths = list(paths)
+        for i in range(0, len(paths), 100):  # Admin API: maks 100 id per panggilan
+            cloudinary.api.delete_resources(paths[i:i + 100], resource_type="raw", invalidate=True)
+
+    def delete_prefix(self, prefix):
+        cloudinary.api.delete_resources_by_prefix(prefix, resource_type="raw", invalidate=True)
+
+
+class LocalStorage(StorageBackend):
+    """Offline/benchmark: file di folder lokal, dengan latensi buatan (detik) per operasi"""
+
+    def __init__(self, root, latency=0.0):
+        self.root, self.latency = os.path.abspath(root), float(latency)
+
+    def _wait(self):
+        if self.latency > 0: time.sleep(self.latency)
+
+    def _file(self, path):
+        return os.path.join(self.root, *path.split('/'))
+
+    @staticmethod
+    def _etag(info):
+        # Dari metadata saja (seperti listing Cloudinary): stat/list tidak membaca isi file
+        return f"{info.st_size:x}-{info.st_mtime_ns:x}"
+
+    def _meta(self, path):
+        info = os.stat(self._file(path))
+        return {'path': path, 'version': info.st_mtime_ns, 'etag': self._etag(info), 'bytes': info.st_size,
+                'created_at': datetime.fromtimestamp(info.st_mtime).isoformat(timespec='seconds')}
+
+    def get(self, path, version=None, fresh=False):
+        self._wait()
+        try:
+            with open(self._file(path), 'rb') as fh: return fh.read()
+        except FileNotFoundError: return None
+
+    def get_if_changed(self, path, etag=None):
+        self._wait()
+        try:
+            with open(self._file(path), 'rb') as fh:
+                new_etag = self._etag(os.fstat(fh.fileno()))
+                return (NOT_MODIFIED if new_etag == etag else fh.read()), new_etag
+        except FileNotFoundError: return None, None
+
+    def put(self, path, data):
+        self._wait()
+        fp = self._file(path)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        tmp = f"{fp}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as fh: fh.write(data)
+        os.replace(tmp, fp)  # Ganti file secara atomik
+        return self._meta(path)
+
+    def create(self, path, data):
+        self._wait()
+        fp = self._file(path)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        try: fd = os.open(fp, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError: return None
+        with os.fdopen(fd, 'wb') as fh: fh.write(data)
+        return self._meta(path)
+
+    def stat(self, path):
+        self._wait()
+        try: return self._meta(path)
+        except FileNotFoundError: return None
+
+    def list(self, prefix):
+        self._wait()
+        out = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                rel = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/')
+                if rel.startswith(prefix) and not rel.endswith('.tmp'):
+                    try: out.append(self._meta(rel))
+                    except FileNotFoundError: pass
+        return sorted(out, key=lambda f: f['path'])
+
+    def delete(self, paths):
+        self._wait()
+        for path in paths:
+            try: os.remove(self._file(path))
+            except FileNotFoundError: pass
+
+
+class TracedStorage(StorageBackend):
+    """Pembungkus backend: setiap operasi storage dicatat (durasi, bytes, error) ke PerfRecorder"""
+
+    def __init__(self, inner, perf):
+        self.inner, self.perf = inner, perf
+
+    def get(self, path, version=None, fresh=False):
+        with self.perf.span("storage.get") as sp:
+            data = self.inner.get(path, version, fresh)
+            sp['bytes'] = len(data) if data else 0
+            return data
+
+    def get_if_changed(self, path, etag=None):
+        with self.perf.span("storage.get_if_changed") as sp:
+            data, new_etag = self.inner.get_if_changed(path, etag)
+            sp['bytes'] = len(data) if isinstance(data, bytes) else 0
+            return data, new_etag
+
+    def put(self, path, data):
+        with self.perf.span("storage.put", len(data)):
+            return self.inner.put(path, data)
+
+    def create(self, path, data):
+        with self.perf.span("storage.create", len(data)):
+            return self.inner.create(path, data)
+
+    def stat(self, path):
+        with self.perf.span("storage.stat"):
+            return self.inner.stat(path)
+
+    def list(self, prefix):
+        with self.perf.span("storage.list"):
+            return self.inner.list(prefix)
+
+    def delete(self, paths):
+        with self.perf.span("storage.delete"):
+            return self.inner.delete(paths)
+
+    def delete_prefix(self, prefix):
+        with self.perf.span("storage.delete_prefix"):
+            return self.inner.delete_prefix(prefix)
+
+
+@st.cache_resource
+def get_storage():
+    """Backend dipilih lewat env PARETO_STORAGE (default: cloudinary), selalu terinstrumentasi"""
+    if STORAGE_BACKEND == "local":
+        backend = LocalStorage(os.environ.get("PARETO_STORAGE_DIR", "storage_local"), os.environ.get("PARETO_STORAGE_LATENCY", "0"))
+    else:
+        backend = CloudinaryStorage(st.secrets["cloud_name"])
+    return TracedStorage(backend, get_perf_recorder())
+
+# =================================================================
+# 3. FUNGSI CORE & ANTI-CACHE (VERSI 470+ BARIS)
+# =================================================================
+
+@st.cache_resource
+def _cache_tags():
+    """Versi tag cache di proses ini: 'master', 'progress:<seri>', 'result:<toko>:<seri>' (+ '*')"""
+    return {}
+
+CACHE_TAGS = _cache_tags()  # Referensi langsung: invalidasi juga dipanggil dari thread latar
+
+def cache_tag(*names):
+    """Tuple versi tag; dipakai sebagai argumen fungsi cache sehingga entri lama basi dengan sendirinya"""
+    return tuple(CACHE_TAGS.get(n, 0) for n in names)
+
+def bump_cache_tag(name):
+    CACHE_TAGS[name] = CACHE_TAGS.get(name, 0) + 1
+
+def invalidate_master():
+    bump_cache_tag('master')
+
+def invalidate_progress(version=None):
+    """Tanpa seri = semua seri (dipakai saat folder hasil direset)"""
+    bump_cache_tag(f"progress:{version}" if version else "progress:*")
+
+def invalidate_store_result(toko_code, version):
+    bump_cache_tag(f"result:{toko_code}:{version}")
+
+def invalidate_all_results():
+    bump_cache_tag("result:*")
+
+def reset_session_state():
+    """Bersihkan state UI sesi ini saja (editor & cache hasil sesi); cache bersama sesi lain tidak disentuh"""
+    keys_to_delete = [k for k in st.session_state.keys() if any(x in k for x in ['ed_', 'result', 'data_toko', 'hash'])]
+    for key in keys_to_delete:
+        del st.session_state[key]
 
 def clean_numeric(val):
     """Konversi standar akuntansi ke float murni"""
@@ -94,140 +474,1012 @@ def clean_numeric(val):
         return float(s)
     except: return 0.0
 
-@st.cache_data(ttl=2) 
-def get_master_data():
-    """Ambil Master Data dengan Invalidation Cache"""
-    try:
-        v = datetime.now().strftime("%m-%Y") 
-        res = cloudinary.api.resource(MASTER_PATH, resource_type="raw", invalidate=True)
-        url_master = f"{res['secure_url']}?t={int(time.time())}"
-        resp = requests.get(url_master)
-        df = pd.read_excel(io.BytesIO(resp.content))
-        df.columns = [str(c).strip().upper() for c in df.columns]
+_FLOAT_RE = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+def clean_numeric_series(ser):
+    """Versi vektor clean_numeric (hasil identik, tanpa panggilan Python per sel)"""
+    ser = pd.Series(ser)
+    if pd.api.types.is_numeric_dtype(ser) and not pd.api.types.is_bool_dtype(ser):
+        return ser.astype(float).fillna(0.0)
+    blank = ser.isna() | ser.eq("")
+    s = ser.astype(str).str.replace(',', '', regex=False).str.replace(' ', '', regex=False)
+    neg = s.str.contains('(', regex=False) & s.str.contains(')', regex=False)
+    s = s.where(~neg, '-' + s.str.replace('(', '', regex=False).str.replace(')', '', regex=False))
+    out = pd.Series(0.0, index=ser.index)
+    todo = ~blank
+    # Jalur cepat: string angka standar dikonversi sekaligus (float() per elemen di C)
+    fast = todo & s.str.match(_FLOAT_RE)
+    out[fast] = s[fast].astype(float)
+    # Sisa (format aneh: 'nan', 'inf', '1_000', teks) -> fallback per sel ke clean_numeric
+    rest = todo & ~fast
+    if rest.any():
+        out[rest] = ser[rest].map(clean_numeric)
+    return out
+
+def master_part_path(am, content_hash):
+    """Shard 1 AM, content-addressed: isi berubah = file baru, file lama tidak pernah ditimpa"""
+    return f"{MASTER_PART_DIR}/am_{hashlib.md5(str(am).encode()).hexdigest()[:8]}_{content_hash}.parquet"
+
+def result_path(toko_code, version):
+    """Hasil input format delta (hanya KDTOKO, PLU & KETERANGAN item NK)"""
+    return f"{HASIL_DIR}/Hasil_{toko_code}_v{version}.json"
+
+def legacy_result_path(toko_code, version):
+    """Format lama: salinan penuh kolom master dalam xlsx (tetap bisa dibaca)"""
+    return f"{HASIL_DIR}/Hasil_{toko_code}_v{version}.xlsx"
+
+def result_store_code(path, version):
+    """KDTOKO dari nama file hasil (format delta maupun lama), None jika bukan seri tsb"""
+    name = path.split('/')[-1]
+    for ext in ('.json', '.xlsx'):
+        suffix = f"_v{version}{ext}"
+        if name.startswith("Hasil_") and name.endswith(suffix):
+            return name[len("Hasil_"):-len(suffix)]
+    return None
+
+_SERIES_FILE_RE = re.compile(r'_v([^_/]+)\.(?:json|xlsx)$')
+SERIES_RE = re.compile(r'^\d{2}-\d{4}$')  # Format seri MM-YYYY
+
+def path_series(path):
+    """Seri (MM-YYYY) dari nama file hasil / manifest progres / state rekap, None jika tidak dikenali"""
+    m = _SERIES_FILE_RE.search(path.split('/')[-1])
+    return m.group(1) if m else None
+
+def normalize_master_frame(df):
+    """Standarisasi kolom & tipe master hasil baca Excel"""
+    df.columns = [str(c).strip().upper() for c in df.columns]
+    with trace("master.normalize"):
         for col in df.columns:
             if col in ['QTY', 'RUPIAH']:
-                df[col] = df[col].apply(clean_numeric)
+                df[col] = clean_numeric_series(df[col])
             else:
                 df[col] = df[col].fillna("")
-        
-        # JAMINAN: Selalu bersihkan kolom keterangan yang ada di master
-        if 'KETERANGAN' in df.columns:
-            df['KETERANGAN'] = ""
-        return df, v
+    
+    # JAMINAN: Selalu bersihkan kolom keterangan yang ada di master
+    if 'KETERANGAN' in df.columns:
+        df['KETERANGAN'] = ""
+    return df
+
+@st.cache_data(ttl=30, max_entries=4, show_spinner=False)
+def _fetch_master_meta(tag):
+    # Error API sengaja tidak ditangkap di sini: exception tidak ikut di-cache, None hanya untuk "tidak ada"
+    # Katalog partisi lebih dulu; master xlsx lama hanya jika belum pernah dipartisi
+    for kind, path in (('catalog', MASTER_CATALOG), ('xlsx', MASTER_PATH)):
+        meta = get_storage().stat(path)
+        if meta is not None:
+            return {'version': meta['version'], 'etag': meta['etag'] or str(meta['version']), 'kind': kind}
+    return None
+
+def get_master_meta():
+    """Cek versi/etag master (1 Admin API call per 30 detik, dipakai bersama semua sesi).
+    Gagal sementara (rate limit/timeout) -> None untuk rerun ini saja, rerun berikutnya mencoba lagi"""
+    try: return _fetch_master_meta(cache_tag('master'))
+    except: return None
+
+@st.cache_resource
+def _master_frame_slot():
+    """1 frame master per proses (etag terakhir), dipakai bersama semua sesi & thread snapshot progres"""
+    return {'lock': threading.Lock(), 'etag': None, 'df': None}
+
+MASTER_FRAME = _master_frame_slot()
+
+def load_master_by_etag(etag, version, kind="xlsx", storage=None):
+    """Master dikunci oleh etag: download ulang HANYA jika isi master berubah (1x per proses).
+    Frame dipakai bersama -> anggap read-only, .copy() dulu sebelum diubah"""
+    with MASTER_FRAME['lock']:  # Sesi/thread lain menunggu 1 download yang sama, bukan ikut mengunduh
+        if MASTER_FRAME['etag'] != etag:
+            MASTER_FRAME['df'] = None  # Lepas frame lama sebelum memuat yang baru
+            MASTER_FRAME['df'] = read_master_frame(storage or get_storage(), etag, version, kind)
+            MASTER_FRAME['etag'] = etag
+        return MASTER_FRAME['df']
+
+def load_master_catalog(storage, version=None):
+    """Katalog {'columns', 'parts': {AM: {'path', 'rows', 'kdtoko', 'stores'}}}; None jika belum ada"""
+    data = storage.get(MASTER_CATALOG, version=version, fresh=version is None)
+    return json.loads(data) if data is not None else None
+
+@st.cache_data(max_entries=3, show_spinner=False)
+def _fetch_master_catalog(etag, version):
+    cat = load_master_catalog(get_storage(), version)
+    if cat is None: raise FileNotFoundError(MASTER_CATALOG)
+    return cat
+
+def read_master_part(storage, path):
+    data = storage.get(path)  # Content-addressed: tidak perlu cache-buster
+    if data is None: raise FileNotFoundError(path)
+    with trace("master.read_part", len(data)):
+        return pd.read_parquet(io.BytesIO(data))
+
+def read_master_frame(storage, etag, version, kind="xlsx"):
+    """Baca master versi tertentu tanpa cache Streamlit (juga dipakai thread latar)"""
+    if kind == 'catalog':
+        # Master penuh (HOME & rekap) = gabungan semua shard AM, diunduh paralel
+        cat = load_master_catalog(storage, version)
+        if cat is None: raise FileNotFoundError(MASTER_CATALOG)
+        paths = [cat['parts'][am]['path'] for am in sorted(cat['parts'])]
+        with ThreadPoolExecutor(max_workers=REKAP_WORKERS) as pool:
+            frames = list(pool.map(lambda p: read_master_part(storage, p), paths))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        df = df.reindex(columns=cat['columns'])
+        for col in df.columns:
+            if col not in ['QTY', 'RUPIAH']: df[col] = df[col].fillna("")
+        return df
+    # Master xlsx lama (belum dipartisi); nomor versi di URL, jadi tidak perlu cache-buster
+    data = storage.get(MASTER_PATH, version=version)
+    if data is None: raise FileNotFoundError(MASTER_PATH)
+    with trace("master.read_excel", len(data)):
+        df = pd.read_excel(io.BytesIO(data))
+    return normalize_master_frame(df)
+
+def current_series():
+    """Seri aktif = bulan berjalan (MM-YYYY)"""
+    return datetime.now().strftime("%m-%Y")
+
+def get_master_data():
+    """Ambil Master Data (cache per versi master, bukan per 2 detik)"""
+    v = current_series()
+    meta = get_master_meta()
+    if meta is None: return pd.DataFrame(), v
+    try:
+        return load_master_by_etag(meta['etag'], meta['version'], meta['kind']), v
     except: 
-        return pd.DataFrame(), datetime.now().strftime("%m-%Y")
+        return pd.DataFrame(), v
+
+def _coerce_input_frame(df):
+    """Koersi string/angka dilakukan sekali saat index dibangun, bukan di setiap rerun halaman input"""
+    df['PLU'] = df['PLU'].astype(str).str.strip()
+    for col in ['PLU', 'DESC']:
+        df[col] = df[col].astype(str).replace(['nan','NaN','None'], '')
+    for col in ['QTY', 'RUPIAH']:
+        df[col] = clean_numeric_series(df[col])
+    return df
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def build_master_index(etag, version, kind="xlsx"):
+    """Index AM -> toko -> blok baris siap pakai; dibangun 1x per versi master & dipakai semua sesi"""
+    df = load_master_by_etag(etag, version, kind).copy()
+    with trace("master.build_index"):
+        cols = list(df.columns)
+        _coerce_input_frame(df)
+        stores, rows = {}, {}
+        for am, df_am in df.groupby('AM', sort=False):
+            stores[am] = sorted(df_am['NAMA TOKO'].unique())
+            for nama, block in df_am.groupby('NAMA TOKO', sort=False):
+                rows[(am, nama)] = block
+    return {'columns': cols, 'am_list': sorted(stores), 'stores': stores, 'rows': rows}
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def build_part_index(path):
+    """Blok baris per NAMA TOKO untuk 1 shard AM (path content-addressed -> tidak pernah basi)"""
+    df = read_master_part(get_storage(), path)
+    with trace("master.build_index"):
+        _coerce_input_frame(df)
+        return {str(nama): block for nama, block in df.groupby('NAMA TOKO', sort=False)}
+
+def get_master_index():
+    """Index master versi aktif (None jika master belum ada / gagal dimuat).
+    Master terpartisi: hanya katalog; baris toko dimuat per shard AM lewat get_store_rows"""
+    meta = get_master_meta()
+    if meta is None: return None
+    try:
+        if meta['kind'] == 'catalog':
+            cat = _fetch_master_catalog(meta['etag'], meta['version'])
+            return {'columns': cat['columns'], 'am_list': sorted(cat['parts']),
+                    'stores': {am: p['stores'] for am, p in cat['parts'].items()}, 'parts': cat['parts']}
+        return build_master_index(meta['etag'], meta['version'], meta['kind'])
+    except: return None
+
+def get_store_rows(idx, am, nama):
+    """Blok baris 1 toko; None jika shard AM gagal dimuat"""
+    if 'rows' in idx: return idx['rows'][(am, nama)]
+    try: return build_part_index(idx['parts'][am]['path'])[str(nama)]
+    except: return None
+
+def _parquet_safe(df):
+    """Kolom object bertipe campuran (mis. angka + teks) dijadikan teks agar bisa ditulis parquet"""
+    for col in df.columns:
+        if df[col].dtype == object and df[col].map(type).nunique() > 1: df[col] = df[col].astype(str)
+    return df
+
+def _master_keys(df):
+    return df['KDTOKO'].astype(str).str.strip() + "\x1f" + df['PLU'].astype(str).str.strip()
+
+def update_master_partitions(df_new):
+    """Gabung upload ke master terpartisi: hanya shard AM yang tersentuh yang ditulis ulang.
+    Baris (KDTOKO, PLU) yang sama diganti upload meskipun tokonya pindah AM (setara drop_duplicates keep='last')."""
+    storage = get_storage()
+    cat = load_master_catalog(storage)
+    df_new = df_new.drop_duplicates(subset=['KDTOKO', 'PLU'], keep='last').copy()
+    df_new['AM'] = df_new['AM'].astype(str)  # Kunci katalog JSON selalu teks
+    if 'KETERANGAN' in df_new.columns: df_new['KETERANGAN'] = ""
+    if cat is None:
+        # Migrasi dari master xlsx lama: semua AM ditulis sebagai shard sekali ini (gagal baca = batal, bukan master kosong)
+        old = storage.stat(MASTER_PATH)
+        df_old = read_master_frame(storage, old['etag'] or str(old['version']), old['version']) if old else pd.DataFrame()
+        parts_old, columns = {}, list(df_old.columns)
+        frames = {str(am): g for am, g in df_old.groupby('AM', sort=False)} if not df_old.empty else {}
+    else:
+        parts_old, columns, frames = cat['parts'], list(cat['columns']), {}
+    columns += [c for c in df_new.columns if c not in columns]
+    
+    new_keys = set(_master_keys(df_new))
+    new_kd, new_am = set(df_new['KDTOKO'].astype(str).str.strip()), set(df_new['AM'])
+    for am, p in parts_old.items():
+        if am in new_am or new_kd.intersection(p['kdtoko']):  # Shard AM tujuan & asal toko pindah
+            frames[am] = read_master_part(storage, p['path'])
+    touched = {am: df_p[~_master_keys(df_p).isin(new_keys)] for am, df_p in frames.items()}
+    for am, df_n in df_new.groupby('AM', sort=False):
+        touched[am] = pd.concat([touched[am], df_n], ignore_index=True) if am in touched else df_n
+    
+    parts, written = dict(parts_old), 0
+    with trace("master.write_parts"):
+        for am, df_p in touched.items():
+            if df_p.empty:
+                parts.pop(am, None); continue
+            df_p = _parquet_safe(df_p.reindex(columns=[c for c in columns if c in df_p.columns]).reset_index(drop=True))
+            h = hashlib.md5(json.dumps(list(df_p.columns)).encode() + pd.util.hash_pandas_object(df_p, index=False).values.tobytes())
+            path = master_part_path(am, h.hexdigest())
+            if parts_old.get(am, {}).get('path') != path:
+                buf_p = io.BytesIO()
+                df_p.to_parquet(buf_p, index=False)
+                storage.put(path, buf_p.getvalue())
+                written += 1
+            parts[am] = {'path': path, 'rows': len(df_p),
+                         'kdtoko': sorted(df_p['KDTOKO'].astype(str).str.strip().unique()),
+                         'stores': sorted(df_p['NAMA TOKO'].astype(str).unique()) if 'NAMA TOKO' in df_p.columns else []}
+    
+    # Shard yang dilepas dicatat di 'retired' dan baru dihapus setelah MASTER_PART_GRACE_SEC: pembaca yang
+    # masih memegang katalog lama (meta di-cache 30 detik) tetap bisa memuatnya, berapa pun update di antaranya
+    now, current = time.time(), {p['path'] for p in parts.values()}
+    retired = {path: at for path, at in (cat or {}).get('retired', {}).items()
+               if now - at < MASTER_PART_GRACE_SEC and path not in current}
+    for path in {p['path'] for p in parts_old.values()} - current: retired.setdefault(path, now)
+    catalog = {'schema': 1, 'updated_at': datetime.now().isoformat(timespec='seconds'), 'columns': columns,
+               'parts': parts, 'retired': retired}
+    storage.put(MASTER_CATALOG, json.dumps(catalog).encode())
+    keep = {MASTER_CATALOG} | current | set(retired)
+    try:
+        stale = [f['path'] for f in storage.list(f"{MASTER_PART_DIR}/") if f['path'] not in keep]
+        if stale: storage.delete(stale)
+        if cat is None:
+            storage.delete([MASTER_PATH])
+            storage.delete_prefix(f"{MASTER_SNAPSHOT_DIR}/")
+    except: pass
+    return {'written': written, 'touched': len(touched), 'parts': len(parts)}
+
+def encode_result_delta(df_nk, toko_code, version, nl_plu=()):
+    """Delta hasil 1 toko: PLU + KETERANGAN item NK, plus daftar PLU item NL saat simpan (NL_KETERANGAN)"""
+    return json.dumps({
+        'schema': RESULT_SCHEMA, 'kdtoko': str(toko_code), 'series': version,
+        'saved_at': datetime.now().isoformat(timespec='seconds'),
+        'columns': ['PLU', 'KETERANGAN'],
+        'rows': [[str(plu), str(ket)] for plu, ket in zip(df_nk['PLU'], df_nk['KETERANGAN'])],
+        'nl': [str(plu) for plu in nl_plu],
+    }, ensure_ascii=False).encode()
+
+def decode_result_delta(data):
+    doc = json.loads(data)
+    if doc.get('schema', 0) > RESULT_SCHEMA:
+        raise ValueError(f"Format hasil schema {doc.get('schema')} belum didukung versi app ini")
+    df_res = pd.DataFrame(doc.get('rows', []), columns=doc.get('columns', ['PLU', 'KETERANGAN']))
+    if 'nl' in doc:
+        df_res = pd.concat([df_res, pd.DataFrame({'PLU': doc['nl'], 'KETERANGAN': NL_KETERANGAN})], ignore_index=True)
+    df_res.insert(0, 'KDTOKO', doc.get('kdtoko', ''))
+    # Delta lama tanpa 'nl': item NL tidak tercatat, rekap mengisinya dari master (nl_explicit=False)
+    df_res.attrs['nl_explicit'] = 'nl' in doc
+    return df_res
+
+def parse_result_bytes(data, path):
+    """Baca file hasil 1 toko (delta .json atau xlsx lama) jadi DataFrame dengan kolom standar"""
+    if path.endswith('.json'):
+        with trace("result.parse_json", len(data)):
+            return decode_result_delta(data)
+    with trace("result.read_excel", len(data)):
+        df_res = pd.read_excel(io.BytesIO(data))
+    df_res.columns = [str(c).strip().upper() for c in df_res.columns]
+    for col in ['QTY', 'RUPIAH']:
+        if col in df_res.columns: df_res[col] = clean_numeric_series(df_res[col])
+    return df_res
 
 def get_existing_result(toko_code, version):
-    """Verifikasi FISIK file di Cloudinary (Bypass Cache CDN)"""
+    """Hasil tersimpan 1 toko: cache per sesi, 1 GET kondisional saat cache basi, Admin API hanya fallback"""
+    key = (str(toko_code), version)
+    gen = cache_tag("result:*", f"result:{key[0]}:{version}")
+    cache = st.session_state.setdefault('result_cache', {})
+    hit = cache.get(key)
+    if hit is not None and hit['gen'] == gen:
+        return hit['df']
+    
+    storage = get_storage()
     try:
-        p_id = f"pareto_nkl/hasil/Hasil_{toko_code}_v{version}.xlsx"
-        url = f"https://res.cloudinary.com/{st.secrets['cloud_name']}/raw/upload/v1/{p_id}?t={int(time.time())}"
-        
-        # PING: Pastikan file benar-benar ada (Status 200)
-        resp = requests.get(url, timeout=3)
-        if resp.status_code == 200:
-            df_res = pd.read_excel(io.BytesIO(resp.content))
-            df_res.columns = [str(c).strip().upper() for c in df_res.columns]
-            return df_res
-        return None
+        # Format delta dulu (1 GET kondisional); xlsx lama hanya dicoba jika delta belum ada
+        for p_id in (result_path(toko_code, version), legacy_result_path(toko_code, version)):
+            same_file = hit is not None and hit.get('path') == p_id
+            data, etag = storage.get_if_changed(p_id, hit['etag'] if same_file else None)
+            if data is not None: break
+    except Exception:
+        # FALLBACK: CDN gagal -> pastikan lewat Admin API apakah file memang ada
+        if not validate_file_exists_in_cloudinary(toko_code, version):
+            cache[key] = {'gen': gen, 'path': None, 'etag': None, 'df': None}
+            return None
+        try:
+            p_id = result_path(toko_code, version)
+            if storage.stat(p_id) is None: p_id = legacy_result_path(toko_code, version)
+            return parse_result_bytes(storage.get(p_id, fresh=True), p_id)
+        except: return hit['df'] if hit else None
+    
+    try:
+        if data is None: df_res, p_id = None, None
+        elif not isinstance(data, bytes): df_res = hit['df']  # NOT_MODIFIED: isi sama dengan cache sesi
+        else: df_res = parse_result_bytes(data, p_id)
     except: return None
+    cache[key] = {'gen': gen, 'path': p_id, 'etag': etag, 'df': df_res}
+    return df_res
 
 def validate_file_exists_in_cloudinary(toko_code, version):
     """Pengecekan API untuk memastikan file tidak ghosting"""
     try:
-        p_id = f"pareto_nkl/hasil/Hasil_{toko_code}_v{version}.xlsx"
-        cloudinary.api.resource(p_id, resource_type="raw")
-        return True
+        storage = get_storage()
+        return any(storage.stat(p) is not None for p in (result_path(toko_code, version), legacy_result_path(toko_code, version)))
     except: return False
 
-def update_user_db(new_db):
-    """Simpan perubahan database user ke cloud"""
-    try:
-        cloudinary.uploader.upload(
-            io.BytesIO(json.dumps(new_db).encode()), 
-            resource_type="raw", public_id=USER_DB, overwrite=True, invalidate=True
-        )
-        clear_all_caches()
-        return True
-    except: return False
+def user_shard_key(nik):
+    """Awalan NIK penentu shard (karakter non alfanumerik -> '_', NIK pendek dipad '_')"""
+    return re.sub(r'[^0-9A-Za-z]', '_', str(nik).strip())[:USER_SHARD_LEN].ljust(USER_SHARD_LEN, '_')
+
+def user_shard_path(key):
+    return f"{USER_SHARD_DIR}/users_{key}.json"
+
+def user_record_path(nik):
+    """Objek 1 user (sumber kebenaran password), dibuat atomik saat pendaftaran"""
+    return f"{USER_SHARD_DIR}/nik/{re.sub(r'[^0-9A-Za-z]', '_', str(nik).strip())}.json"
+
+
+class UserIndex:
+    """Index user 1 proses. Sumber kebenaran = 1 objek per NIK (user_record_path): pendaftaran memakai
+    storage.create (tanpa overwrite) sehingga 2 pendaftaran NIK sama di proses/replika berbeda tidak
+    saling menimpa. Shard {NIK: password} per awalan NIK hanya index lookup (TTL) yang bisa dibangun
+    ulang dari objek NIK, sekaligus tempat user lama (USER_DB) yang belum punya objek NIK."""
+
+    def __init__(self, storage, ttl=USER_INDEX_TTL):
+        self.storage, self.ttl = storage, ttl
+        self._shards = {}     # key -> (waktu dimuat, {NIK: password})
+        self._legacy = None   # (waktu dimuat, isi USER_DB)
+        self._index_lock = threading.Lock()  # Tulis index shard di proses ini berurutan (index boleh tertinggal)
+
+    def _load_legacy(self, max_age):
+        if self._legacy is None or time.time() - self._legacy[0] > max_age:
+            data = self.storage.get(USER_DB, fresh=True)
+            self._legacy = (time.time(), json.loads(data) if data is not None else {})
+        return self._legacy[1]
+
+    def _legacy_part(self, key, max_age):
+        return {n: p for n, p in self._load_legacy(max_age).items() if user_shard_key(n) == key}
+
+    def shard(self, nik, max_age=None):
+        """Isi shard NIK ini (1 GET kecil jika lewat TTL); None jika storage error"""
+        key, max_age = user_shard_key(nik), self.ttl if max_age is None else max_age
+        cached = self._shards.get(key)
+        if cached is not None and time.time() - cached[0] <= max_age: return cached[1]
+        try:
+            data = self.storage.get(user_shard_path(key), fresh=True)
+            users = json.loads(data) if data is not None else self._legacy_part(key, self.ttl)  # File lama tetap ber-TTL
+        except: return None
+        self._shards[key] = (time.time(), users)
+        return users
 
-def get_progress_data(df_m, version):
-    """Hitung progres real-time berdasarkan file yang ada di folder hasil"""
+    def _record(self, nik):
+        """Password dari objek NIK, None jika objek belum ada (error storage dilempar)"""
+        data = self.storage.get(user_record_path(nik), fresh=True)
+        return json.loads(data).get('password') if data is not None else None
+
+    def password(self, nik):
+        """Password terkini 1 NIK: objek NIK (1 GET kecil), user lama lewat shard; None = tidak ada.
+        Error storage dilempar"""
+        nik = str(nik).strip()
+        pw = self._record(nik)
+        if pw is not None: return pw
+        users = self.shard(nik)
+        if users is None: raise RuntimeError("database user tidak bisa dibaca")
+        return users.get(nik)
+
+    def check(self, nik, password):
+        """True/False; None jika storage error"""
+        try:
+            pw = self.password(nik)
+            return pw is not None and pw == password
+        except: return None
+
+    def _index(self, nik, password):
+        """Catat NIK di shard index (best effort: yang tertinggal dipulihkan rebuild_index)"""
+        key = user_shard_key(nik)
+        try:
+            with self._index_lock:
+                data = self.storage.get(user_shard_path(key), fresh=True)
+                users = json.loads(data) if data is not None else self._legacy_part(key, 0)
+                users[nik] = password
+                self.storage.put(user_shard_path(key), json.dumps(users).encode())
+                self._shards[key] = (time.time(), users)
+        except: pass
+
+    def update(self, nik, password, create=False):
+        """Set password 1 NIK; return 'ok' | 'exists' (create=True & NIK sudah ada) | 'error'"""
+        nik = str(nik).strip()
+        record = json.dumps({'nik': nik, 'password': password}).encode()
+        try:
+            if create:
+                if self.password(nik) is not None: return 'exists'
+                if self.storage.create(user_record_path(nik), record) is None:
+                    return 'exists'  # Didahului pendaftaran NIK yang sama (atomik di storage)
+            else:
+                self.storage.put(user_record_path(nik), record)  # Reset password admin: timpa objek NIK
+        except: return 'error'
+        self._index(nik, password)
+        return 'ok'
+
+    def migrate_legacy(self):
+        """Pecah USER_DB lama ke shard yang belum ada; return jumlah shard yang ditulis"""
+        with self._index_lock:
+            keys = {user_shard_key(n) for n in self._load_legacy(0)}
+            written = 0
+            for key in sorted(keys):
+                if self.storage.stat(user_shard_path(key)) is not None: continue
+                users = self._legacy_part(key, self.ttl)
+                self.storage.put(user_shard_path(key), json.dumps(users).encode())
+                self._shards[key] = (time.time(), users)
+                written += 1
+            return written
+
+    def rebuild_index(self):
+        """Bangun ulang shard index dari semua objek NIK (+ user lama); return jumlah user"""
+        with self._index_lock:
+            shards = {}
+            for n, p in self._load_legacy(0).items():
+                shards.setdefault(user_shard_key(n), {})[n] = p
+            for f in self.storage.list(f"{USER_SHARD_DIR}/nik/"):
+                data = self.storage.get(f['path'], fresh=True)
+                if data is None: continue
+                rec = json.loads(data)
+                shards.setdefault(user_shard_key(rec['nik']), {})[rec['nik']] = rec['password']
+            for key, users in shards.items():
+                self.storage.put(user_shard_path(key), json.dumps(users).encode())
+                self._shards[key] = (time.time(), users)
+            return sum(len(u) for u in shards.values())
+
+@st.cache_resource
+def get_user_index():
+    return UserIndex(get_storage())
+
+def progress_manifest_path(version):
+    return f"{PROGRESS_DIR}/progress_v{version}.json"
+
+@st.cache_resource
+def _progress_lock():
+    """Lock 1 proses: cegah 2 simpan bersamaan saling menimpa manifest progres"""
+    return threading.Lock()
+
+PROGRESS_LOCK = _progress_lock()
+
+def load_progress_manifest(version, storage=None):
+    """Manifest progres per seri: {'stores': {KDTOKO: {'saved_at':..., 'version':...}}}.
+    None HANYA jika belum ada; error storage/JSON dilempar (bukan dianggap kosong -> scan penuh)"""
+    data = (storage or get_storage()).get(progress_manifest_path(version), fresh=True)
+    return json.loads(data) if data is not None else None
+
+@st.cache_data(ttl=10, max_entries=16, show_spinner=False)
+def _fetch_progress_manifest(version, tag):
+    return load_progress_manifest(version)
+
+def get_progress_manifest(version):
+    try: return _fetch_progress_manifest(version, cache_tag("progress:*", f"progress:{version}"))
+    except: return None  # Error tidak di-cache; rerun berikutnya mencoba lagi
+
+def save_progress_manifest(version, manifest, storage=None):
+    """Manifest ditulis sebagai 1 objek utuh (replace atomik di storage)"""
+    (storage or get_storage()).put(progress_manifest_path(version), json.dumps(manifest).encode())
+
+def scan_progress_manifest(version, storage=None):
+    """Susun manifest dari listing folder hasil (paginasi via next_cursor)"""
+    stores = {}
+    for f in (storage or get_storage()).list(f"{HASIL_DIR}/Hasil_"):
+        toko_code = result_store_code(f['path'], version)
+        if toko_code is not None:
+            stores[toko_code] = {'saved_at': f.get('created_at'), 'version': f.get('version')}
+    return {'series': version, 'stores': stores}
+
+def ensure_progress_manifest(version, storage=None):
+    """Manifest seri ini; jika belum ada (awal bulan), folder hasil di-scan SEKALI lalu disimpan"""
+    manifest = load_progress_manifest(version, storage)
+    if manifest is not None: return manifest
+    with PROGRESS_LOCK:
+        manifest = load_progress_manifest(version, storage)  # Bisa saja baru ditulis thread/sesi lain
+        if manifest is None:
+            manifest = scan_progress_manifest(version, storage)
+            save_progress_manifest(version, manifest, storage)
+            invalidate_progress(version)
+    return manifest
+
+def rebuild_progress_manifest(version):
+    """PERBAIKAN: tulis ulang manifest dari isi folder hasil yang sebenarnya"""
+    with PROGRESS_LOCK:
+        manifest = scan_progress_manifest(version)
+        save_progress_manifest(version, manifest)
+    invalidate_progress(version)
+    get_progress_service().notify()
+    return manifest
+
+def mark_store_saved(toko_code, version, file_version=None, storage=None):
+    """Catat 1 toko selesai di manifest progres (dipanggil setelah Simpan Hasil Input).
+    Read-modify-write dijaga lock 1 proses: asumsi app berjalan sebagai 1 proses Streamlit; dengan
+    beberapa replika, toko yang tertimpa dipulihkan lewat "Rebuild Manifest Progres".
+    Gagal baca manifest dilempar (simpan diulang antrian), hanya manifest yang belum ada yang di-scan"""
+    with PROGRESS_LOCK:
+        manifest = load_progress_manifest(version, storage) or scan_progress_manifest(version, storage)
+        manifest.setdefault('stores', {})[str(toko_code)] = {'saved_at': datetime.now().isoformat(timespec='seconds'), 'version': file_version}
+        save_progress_manifest(version, manifest, storage)
+    invalidate_progress(version)
+
+def get_progress_data(df_m, version, manifest=None):
+    """Hitung progres dari manifest progres (1 objek kecil, lookup pakai set)"""
     if df_m.empty: return pd.DataFrame(), []
     try:
-        res = cloudinary.api.resources(resource_type="raw", type="upload", prefix="pareto_nkl/hasil/Hasil_", max_results=500)
-        files = res.get('resources', [])
-        finished_stores = []
-        suffix = f"_v{version}.xlsx"
-        for f in files:
-            p_id = f['public_id'].split('/')[-1]
-            if p_id.endswith(suffix):
-                finished_stores.append(p_id.replace("Hasil_", "").replace(suffix, ""))
-        
+        manifest = manifest or get_progress_manifest(version) or ensure_progress_manifest(version)
+        finished_stores = set(manifest.get('stores', {}))
         df_unique = df_m.drop_duplicates(subset=['KDTOKO']).copy()
-        df_unique['STATUS'] = df_unique['KDTOKO'].apply(lambda x: 1 if x in finished_stores else 0)
-        return df_unique, finished_stores
+        df_unique['STATUS'] = df_unique['KDTOKO'].astype(str).isin(finished_stores).astype(int)
+        return df_unique, sorted(finished_stores)
     except: return pd.DataFrame(), []
 
+def compute_progress_snapshot(df_m, version, manifest):
+    """Semua angka & tabel dashboard HOME dihitung sekali, lalu dibaca bersama semua pengunjung"""
+    with trace("progress.snapshot"):
+        return _compute_progress_snapshot(df_m, version, manifest)
+
+def _compute_progress_snapshot(df_m, version, manifest):
+    df_u, _ = get_progress_data(df_m, version, manifest)
+    if df_u.empty: return None
+    
+    def summarize(col):
+        agg = df_u.groupby(col).agg(Target_Toko_SO=('KDTOKO', 'count'), Sudah_SO=('STATUS', 'sum')).reset_index()
+        agg['Belum_SO'] = agg['Target_Toko_SO'] - agg['Sudah_SO']
+        agg['Progres_Val'] = (agg['Sudah_SO'] / agg['Target_Toko_SO']).round(2)
+        return agg.sort_values('Progres_Val')
+    
+    def pending_by(col):
+        out = {}
+        for key, grp in df_belum.groupby(col, sort=True):
+            out[key] = grp[['KDTOKO', 'NAMA TOKO']].set_axis(['Kode', 'Nama'], axis=1)
+        return out
+    
+    df_belum = df_u[df_u['STATUS'] == 0]
+    total_t, sudah_t = len(df_u), int(df_u['STATUS'].sum())
+    return {
+        'version': version, 'computed_at': datetime.now(),
+        'total': total_t, 'sudah': sudah_t, 'belum': total_t - sudah_t,
+        'am_sum': summarize('AM'), 'as_sum': summarize('AS'),
+        'belum_am': pending_by('AM'), 'belum_as': pending_by('AS'),
+    }
+
+class ProgressSnapshotService:
+    """Snapshot progres 1 proses + thread latar: segar tiap interval atau segera saat ada event simpan"""
+
+    def __init__(self, storage, interval=PROGRESS_REFRESH_SEC, idle_after=PROGRESS_IDLE_SEC):
+        self.storage, self.interval, self.idle_after = storage, interval, idle_after
+        self.snapshot, self.last_error, self._failed_at = None, None, 0.0
+        self._target = None               # (meta master, seri) terakhir yang diminta halaman HOME
+        self._last_read = time.time()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="progress-snapshot", daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def read(self, meta, version):
+        """Dipanggil tiap render HOME: kembalikan snapshot; hitung sinkron hanya jika belum ada/master berganti"""
+        self._last_read = time.time()
+        self._target = (meta, version)
+        if not self._is_current(meta, version):
+            if time.time() - self._failed_at >= PROGRESS_FAIL_BACKOFF_SEC:
+                self.refresh(only_if_stale=True)
+            else:
+                self.notify()  # Storage sedang gagal: retry diserahkan ke thread latar, HOME tidak ikut antre
+        return self.snapshot
+
+    def _is_current(self, meta, version):
+        snap = self.snapshot
+        return snap is not None and snap['version'] == version and snap['etag'] == meta['etag']
+
+    def refresh(self, only_if_stale=False):
+        with self._refresh_lock:  # Banyak sesi bersamaan -> cukup 1 yang menghitung
+            if self._target is None: return
+            meta, version = self._target
+            if only_if_stale and self._is_current(meta, version): return
+            # Sesi yang antre di lock saat refresh barusan gagal tidak mengulang percobaan yang sama
+            if only_if_stale and time.time() - self._failed_at < PROGRESS_FAIL_BACKOFF_SEC: return
+            try:
+                # Frame master yang sama dengan get_master_data (tanpa download/salinan kedua)
+                df_m = load_master_by_etag(meta['etag'], meta['version'], meta['kind'], self.storage)
+                manifest = ensure_progress_manifest(version, self.storage)
+                snap = compute_progress_snapshot(df_m, version, manifest)
+                if snap is not None: snap['etag'] = meta['etag']
+                self.snapshot, self.last_error, self._failed_at = snap, None, 0.0
+            except Exception as e:
+                self._failed_at = time.time()
+                self.last_error = str(e) or type(e).__name__
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if time.time() - self._last_read < self.idle_after:  # Tidak ada pengunjung -> tidak perlu download
+                self.refresh()
+
+@st.cache_resource
+def get_progress_service():
+    return ProgressSnapshotService(get_storage())
+
+def get_progress_snapshot():
+    """Snapshot progres bersama untuk dashboard HOME (None jika master belum ada)"""
+    meta = get_master_meta()
+    if meta is None: return None
+    return get_progress_service().read(meta, current_series())
+
+def write_store_result(storage, toko_code, version, payload):
+    """Upload delta hasil 1 toko (.json) lalu catat di manifest progres; aman dari thread latar"""
+    meta = storage.put(result_path(toko_code, version), payload)
+    invalidate_store_result(toko_code, version)
+    mark_store_saved(toko_code, version, meta.get('version'), storage)  # Gagal -> dilempar agar simpan diulang
+    return meta
+
+def save_store_result(df_nk, toko_code, version, nl_plu=()):
+    """Simpan sinkron (benchmark/skrip); halaman input memakai antrian write-behind get_save_queue()"""
+    meta = write_store_result(get_storage(), toko_code, version, encode_result_delta(df_nk, toko_code, version, nl_plu))
+    get_progress_service().notify()  # Snapshot dashboard HOME disegarkan di latar
+    return meta
+
+
+class SaveQueue:
+    """Write-behind simpan hasil: per (KDTOKO, seri) hanya kiriman terakhir yang diupload, oleh thread latar dengan retry"""
+
+    def __init__(self, storage, progress, workers=SAVE_WORKERS, retries=SAVE_RETRIES):
+        self.storage, self.progress, self.retries = storage, progress, retries
+        self._pending, self._inflight, self._status = {}, set(), {}
+        self._seq = 0
+        self._cv = threading.Condition()
+        for i in range(max(1, int(workers))):
+            threading.Thread(target=self._run, name=f"save-queue-{i}", daemon=True).start()
+
+    def submit(self, df_nk, toko_code, version, nl_plu=()):
+        """Antrikan simpanan & langsung kembali; kiriman toko yang sama yang belum terupload ditimpa"""
+        key, payload = (str(toko_code), version), encode_result_delta(df_nk, toko_code, version, nl_plu)
+        with self._cv:
+            self._seq += 1
+            self._pending[key] = (self._seq, payload)
+            self._status[key] = {'state': 'pending', 'seq': self._seq, 'attempts': 0, 'error': None,
+                                 'at': time.time(), 'frame': df_nk[['PLU', 'KETERANGAN']].copy()}
+            self._cv.notify()
+
+    def cancel(self, keep_series=()):
+        """Buang simpanan yang belum terupload untuk seri selain keep_series (saat admin reset/prune hasil)"""
+        keep = set(keep_series)
+        with self._cv:
+            for key in [k for k in self._pending if k[1] not in keep]:
+                del self._pending[key]
+                self._status[key].update(state='failed', error="dibatalkan karena hasil seri ini direset admin", at=time.time())
+
+    def status(self, toko_code, version):
+        """{'state': pending|saving|saved|failed, 'attempts', 'error', 'at', 'frame'} atau None"""
+        with self._cv:
+            s = self._status.get((str(toko_code), version))
+            return dict(s) if s else None
+
+    def _next(self):
+        with self._cv:
+            while True:
+                key = next((k for k in self._pending if k not in self._inflight), None)
+                if key is not None:  # 1 toko tidak pernah diupload 2 thread bersamaan (urutan terjaga)
+                    self._inflight.add(key)
+                    seq, payload = self._pending.pop(key)
+                    self._status[key]['state'] = 'saving'
+                    return key, seq, payload
+                self._cv.wait()
+
+    def _run(self):
+        while True:
+            key, seq, payload = self._next()
+            error, t0 = None, time.perf_counter()
+            for attempt in range(self.retries + 1):
+                try:
+                    write_store_result(self.storage, key[0], key[1], payload)
+                    error = None
+                    break
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                with self._cv:
+                    if key in self._pending: break  # Sudah ada kiriman lebih baru -> yang lama tidak perlu diulang
+                    if self._status[key]['seq'] == seq: self._status[key]['attempts'] = attempt + 1
+                if attempt < self.retries:
+                    time.sleep(random.uniform(0, min(SAVE_BACKOFF[1], SAVE_BACKOFF[0] * 2 ** attempt)))
+            PERF.record("save.write_behind", time.perf_counter() - t0, len(payload), error)
+            with self._cv:
+                self._inflight.discard(key)
+                s = self._status[key]
+                if s['seq'] == seq:
+                    s.update(state='failed' if error else 'saved', error=error, at=time.time())
+                    if not error: s['frame'] = None
+                if key in self._pending: self._cv.notify()
+            if not error: self.progress.notify()
+
+@st.cache_resource
+def get_save_queue():
+    return SaveQueue(get_storage(), get_progress_service())
+
+def save_status_panel(queue, toko_code, version, busy):
+    """Indikator status simpan latar; saat upload selesai halaman dirender ulang penuh.
+    Pesan sukses (+ balon) hanya muncul setelah file benar-benar tersimpan di cloud"""
+    s = queue.status(toko_code, version)
+    if s is None: return
+    if s['state'] in ('pending', 'saving'):
+        retry = f" (percobaan ke-{s['attempts'] + 1})" if s['attempts'] else ""
+        st.info(f"⏳ Input keterangan {toko_code} sedang disimpan{retry}... Jangan tutup halaman ini.")
+    elif busy: st.rerun()
+    elif s['state'] == 'failed':
+        st.session_state.pop('save_wait', None)
+        st.error(f"❌ Gagal menyimpan hasil {toko_code}: {s['error']}. Klik Simpan lagi untuk mencoba ulang.")
+    elif st.session_state.pop('save_wait', None) == toko_code:
+        # ANIMASI & PESAN SUKSES (Permintaan Baru)
+        st.balloons()
+        st.success("✅ Input keterangan sukses!")
+    else:
+        st.success(f"☁️ Hasil {toko_code} tersimpan di cloud ({time.strftime('%H:%M:%S', time.localtime(s['at']))}).")
+
+def fetch_result_frame(storage, f):
+    """Download 1 file hasil (retry/backoff di layer HTTP) lalu ambil kolom rekap.
+    Return (frame, nl_explicit): xlsx lama & delta baru sudah memuat item NL saat simpan"""
+    data = storage.get(f['path'], version=f.get('version'))
+    if data is None: raise FileNotFoundError(f['path'])
+    df_res = parse_result_bytes(data, f['path'])
+    return df_res[REKAP_COLS], df_res.attrs.get('nl_explicit', True)
+
+def collect_rekap_inputs(files, workers=REKAP_WORKERS, on_progress=None):
+    """Download & parse file hasil secara paralel; per file disimpan (baris, nl_explicit) saat tiap file selesai"""
+    rows_by_file, failures, storage = {}, [], get_storage()
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        futures = {pool.submit(fetch_result_frame, storage, f): f for f in files}
+        for i, fut in enumerate(as_completed(futures), 1):
+            f = futures.pop(fut)
+            try:
+                df_res, nl_explicit = fut.result()
+                rows_by_file[f['path']] = (list(df_res.itertuples(index=False, name=None)), nl_explicit)
+            except Exception as e:
+                failures.append({'FILE': f['path'], 'ERROR': str(e) or type(e).__name__})
+            if on_progress: on_progress(i, len(files))
+    return rows_by_file, failures
+
+def rekap_state_path(version):
+    return f"{REKAP_STATE_DIR}/state_v{version}.json"
+
+def file_signature(f):
+    """Sidik file dari listing storage: berubah jika file ditimpa"""
+    return {'version': f.get('version'), 'bytes': f.get('bytes'), 'etag': f.get('etag')}
+
+def load_rekap_state(version):
+    """State rekap tersimpan: {'files': {path: {'sig':..., 'rows': [[KDTOKO, PLU, KETERANGAN], ...]}}}"""
+    try:
+        data = get_storage().get(rekap_state_path(version), fresh=True)
+        if data is not None: return json.loads(data)
+    except: pass
+    return {'files': {}}
+
+def save_rekap_state(version, state):
+    get_storage().put(rekap_state_path(version), json.dumps(state, default=str).encode())
+
+def refresh_rekap(version, workers=REKAP_WORKERS, on_progress=None):
+    """Rekap inkremental: hanya file baru/berubah yang didownload, file terhapus dibuang dari state"""
+    with trace("rekap.refresh"):
+        return _refresh_rekap(version, workers, on_progress)
+
+def _refresh_rekap(version, workers, on_progress):
+    listing = {f['path']: f for f in get_storage().list(f"{HASIL_DIR}/Hasil_") if result_store_code(f['path'], version) is not None}
+    state = load_rekap_state(version)
+    old_files = state.get('files', {})
+    changed = [f for pid, f in listing.items() if old_files.get(pid, {}).get('sig') != file_signature(f)]
+    
+    rows_by_file, failures = collect_rekap_inputs(changed, workers, on_progress) if changed else ({}, [])
+    new_files = {}
+    for pid, f in listing.items():
+        if pid in rows_by_file:
+            rows, nl_explicit = rows_by_file[pid]
+            new_files[pid] = {'sig': file_signature(f), 'rows': [list(r) for r in rows], 'nl': nl_explicit}
+        elif pid in old_files:
+            new_files[pid] = old_files[pid]  # Tidak berubah (atau gagal dibaca -> pakai isi lama)
+    
+    stats = {'total': len(listing), 'downloaded': len(rows_by_file), 'removed': len(set(old_files) - set(listing)),
+             'stores': {result_store_code(pid, version) for pid in new_files},
+             # Toko dengan delta lama (item NL tidak tercatat): NL diisi dari master saat rekap
+             'nl_implicit': {result_store_code(pid, version) for pid, f in new_files.items() if not f.get('nl', pid.endswith('.xlsx'))},
+             'fingerprint': hashlib.md5(json.dumps(sorted((pid, f['sig']) for pid, f in new_files.items()), default=str).encode()).hexdigest()}
+    if stats['downloaded'] or stats['removed']:
+        try: save_rekap_state(version, {'series': version, 'files': new_files})
+        except Exception as e: failures.append({'FILE': rekap_state_path(version), 'ERROR': str(e) or type(e).__name__})
+    
+    # Baris pertama per (KDTOKO, PLU) yang dipakai (setara drop_duplicates); .json (baru) menang atas .xlsx lama
+    merged = {}
+    for pid in sorted(new_files):
+        for kd, plu, ket in new_files[pid]['rows']:
+            merged.setdefault((str(kd).strip(), str(plu).strip()), ket)
+    combined = pd.DataFrame([(kd, plu, ket) for (kd, plu), ket in merged.items()], columns=REKAP_COLS)
+    return combined, failures, stats
+
+def build_rekap_frame(df_m, combined_in, nl_fill_stores):
+    """Gabungkan master + keterangan hasil input. Item NL diambil dari file hasil; hanya toko di
+    nl_fill_stores (delta lama tanpa daftar NL) yang item NL-nya diisi NL_KETERANGAN dari master"""
+    m_cols = list(df_m.columns)
+    df_m_mrg = df_m.drop(columns=['KETERANGAN']) if 'KETERANGAN' in df_m.columns else df_m.copy()
+    # Kunci gabung dinormalisasi ke teks: delta .json menyimpan PLU sebagai teks, xlsx lama bisa angka
+    df_m_mrg['_KD'] = df_m_mrg['KDTOKO'].astype(str).str.strip()
+    df_m_mrg['_PLU'] = df_m_mrg['PLU'].astype(str).str.strip()
+    keys_in = combined_in.rename(columns={'KDTOKO': '_KD', 'PLU': '_PLU'})
+    with trace("rekap.merge"):
+        final_rekap = df_m_mrg.merge(keys_in, on=['_KD', '_PLU'], how='left').fillna("")
+    nl_mask = final_rekap['_KD'].isin(nl_fill_stores) & (final_rekap['RUPIAH'] >= 0) & (final_rekap['KETERANGAN'] == "")
+    final_rekap.loc[nl_mask, 'KETERANGAN'] = NL_KETERANGAN
+    return final_rekap[m_cols if 'KETERANGAN' in m_cols else m_cols + ['KETERANGAN']]
+
+def iter_rekap_chunks(df_m, combined_in, nl_fill_stores, split_by_am=False):
+    """Yield (bagian, potongan rekap) per REKAP_CHUNK_ROWS baris master; bagian = AM jika split_by_am"""
+    parts = df_m.groupby('AM', sort=True) if split_by_am else [("Rekap", df_m)]
+    for name, part in parts:
+        for start in range(0, len(part), REKAP_CHUNK_ROWS):
+            yield str(name), build_rekap_frame(part.iloc[start:start + REKAP_CHUNK_ROWS], combined_in, nl_fill_stores)
+
+def _export_part_name(name, used, limit):
+    """Nama sheet/file aman & unik (sheet Excel maks 31 karakter, tanpa []:*?/\\)"""
+    base = re.sub(r'[\[\]:*?/\\]', '_', name).strip()[:limit] or "Rekap"
+    title, n = base, 2
+    while title.lower() in used:
+        title = f"{base[:limit - len(str(n)) - 1]}~{n}"; n += 1
+    used.add(title.lower())
+    return title
+
+def write_rekap_export(path, df_m, combined_in, nl_fill_stores, fmt="xlsx", split_by_am=False):
+    """Tulis rekap ke file per potongan (xlsx write-only / zip berisi CSV) tanpa menahan seluruh hasil di memori"""
+    used = set()
+    with trace(f"rekap.export_{fmt}"):
+        if fmt == "xlsx":
+            wb, sheets = openpyxl.Workbook(write_only=True), {}
+            for name, chunk in iter_rekap_chunks(df_m, combined_in, nl_fill_stores, split_by_am):
+                if name not in sheets:
+                    sheets[name] = wb.create_sheet(_export_part_name(name, used, 31))
+                    sheets[name].append(list(chunk.columns))
+                for row in chunk.itertuples(index=False, name=None): sheets[name].append(row)
+            if not sheets: wb.create_sheet("Rekap").append(list(df_m.columns))
+            wb.save(path)
+        else:
+            with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                current, fh = None, None
+                for name, chunk in iter_rekap_chunks(df_m, combined_in, nl_fill_stores, split_by_am):
+                    if name != current:
+                        if fh: fh.close()
+                        fh = io.TextIOWrapper(zf.open(f"{_export_part_name(name, used, 100)}.csv", 'w'), encoding='utf-8-sig', newline='')
+                        current, header = name, True
+                    chunk.to_csv(fh, index=False, header=header)
+                    header = False
+                if fh: fh.close()
+    return path
+
+@st.cache_resource
+def _export_registry():
+    return {}  # key export -> path file (urut lama -> baru)
+
+def get_rekap_export(key, build, ext):
+    """File export di disk dipakai ulang selama key (seri, isi rekap, master, format) sama; build(path) hanya saat berubah"""
+    reg = _export_registry()
+    path = reg.get(key)
+    if path and os.path.exists(path): return path
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"rekap_{hashlib.md5(repr(key).encode()).hexdigest()}.{ext}")
+    fd, tmp = tempfile.mkstemp(dir=EXPORT_DIR, suffix=".part")  # File parsial unik: build bersamaan tidak saling merusak
+    os.close(fd)
+    try:
+        build(tmp)
+        os.replace(tmp, path)
+    except:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+    reg.pop(key, None); reg[key] = path
+    while len(reg) > EXPORT_KEEP:
+        old = reg.pop(next(iter(reg)))
+        try: os.remove(old)
+        except OSError: pass
+    return path
+
+def bulk_delete(paths, workers=DELETE_WORKERS, on_progress=None):
+    """Hapus banyak file per batch DELETE_BATCH secara paralel; return (jumlah terhapus, daftar batch gagal)"""
+    paths, storage = list(paths), get_storage()
+    batches = [paths[i:i + DELETE_BATCH] for i in range(0, len(paths), DELETE_BATCH)]
+    deleted, failures = 0, []
+    with trace("maintenance.bulk_delete"):
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+            futures = {pool.submit(storage.delete, b): b for b in batches}
+            for i, fut in enumerate(as_completed(futures), 1):
+                b = futures.pop(fut)
+                try:
+                    fut.result(); deleted += len(b)
+                except Exception as e:
+                    failures.append({'FILE': f"{b[0]} (+{len(b) - 1} file)", 'ERROR': str(e) or type(e).__name__})
+                if on_progress: on_progress(i, len(batches))
+    return deleted, failures
+
+def prune_results(keep_series=(), workers=DELETE_WORKERS, on_progress=None):
+    """Hapus file hasil semua seri KECUALI keep_series (kosong = hapus semua), beserta manifest progres & state rekap seri tsb.
+    ValueError (tanpa menghapus apa pun) jika seri keep tidak berformat MM-YYYY atau tidak punya file hasil sama sekali"""
+    keep, storage = set(keep_series), get_storage()
+    bad = sorted(v for v in keep if not SERIES_RE.match(str(v)))
+    if bad: raise ValueError(f"Format seri salah: {', '.join(bad)} (harus MM-YYYY)")
+    listing = {prefix: storage.list(prefix) for prefix in (f"{HASIL_DIR}/", f"{PROGRESS_DIR}/", f"{REKAP_STATE_DIR}/")}
+    if keep and not any(path_series(f['path']) in keep for f in listing[f"{HASIL_DIR}/"]):
+        raise ValueError(f"Tidak ada file hasil seri {', '.join(sorted(keep))}; reset dibatalkan agar seri lain tidak ikut terhapus")
+    get_save_queue().cancel(keep)  # Antrian simpan seri yang dihapus tidak boleh menulis ulang hasil/manifest
+    targets, series = [], set()
+    for prefix, files in listing.items():
+        for f in files:
+            v = path_series(f['path'])
+            if v in keep or (keep and v is None): continue  # Mode sisakan: file yang serinya tak dikenali tidak disentuh
+            targets.append(f['path'])
+            if prefix == f"{HASIL_DIR}/" and v: series.add(v)
+    deleted, failures = bulk_delete(targets, workers, on_progress) if targets else (0, [])
+    invalidate_all_results(); invalidate_progress()
+    get_progress_service().notify()  # Dashboard HOME langsung dihitung ulang, tidak menunggu interval
+    return {'found': len(targets), 'deleted': deleted, 'series': sorted(series), 'failures': failures}
+
 # =================================================================
-# 3. ROUTING & HOME (PROGRES SO AM/AS LENGKAP)
+# 4. ROUTING & HOME (PROGRES SO AM/AS LENGKAP)
 # =================================================================
 if 'page' not in st.session_state: st.session_state.page = "HOME"
 
 if st.session_state.page == "HOME":
     st.title("📑 Sistem Penjelasan Pareto NKL")
     
-    df_m_prog, v_prog = get_master_data()
-    if not df_m_prog.empty:
-        df_u, finished_list = get_progress_data(df_m_prog, v_prog)
-        
+    snap_prog = get_progress_snapshot()  # Dibaca dari snapshot bersama, bukan dihitung per sesi
+    if snap_prog is not None:
         # Dashboard Atas
-        total_t, sudah_t = len(df_u), df_u['STATUS'].sum()
-        belum_t = total_t - sudah_t
+        total_t, sudah_t, belum_t = snap_prog['total'], snap_prog['sudah'], snap_prog['belum']
         persen_t = (sudah_t / total_t) if total_t > 0 else 0
         
         c1, c2, c3 = st.columns(3)
         c1.metric("Total Toko", total_t)
         c2.metric("Sudah SO", sudah_t, f"{persen_t:.1%}")
         c3.metric("Belum SO", belum_t, f"-{belum_t}", delta_color="inverse")
+        st.caption(f"Diperbarui {snap_prog['computed_at']:%H:%M:%S}")
         
         st.write("---")
         
         # Progress AM (Sorted Lowest)
         st.write("### 📊 Progres SO PER AM (Urutan Terendah di Atas)")
-        am_sum = df_u.groupby('AM').agg(Target_Toko_SO=('KDTOKO', 'count'), Sudah_SO=('STATUS', 'sum')).reset_index()
-        am_sum['Belum_SO'] = am_sum['Target_Toko_SO'] - am_sum['Sudah_SO']
-        am_sum['Progres_Val'] = (am_sum['Sudah_SO'] / am_sum['Target_Toko_SO']).round(2)
-        st.dataframe(am_sum.sort_values('Progres_Val'), column_config={"Target_Toko_SO":"Target Toko SO","Sudah_SO":"Sudah SO","Belum_SO":"Belum SO","Progres_Val": st.column_config.ProgressColumn("Progres", format="%.2f", min_value=0, max_value=1)}, hide_index=True, use_container_width=True)
+        st.dataframe(snap_prog['am_sum'], column_config={"Target_Toko_SO":"Target Toko SO","Sudah_SO":"Sudah SO","Belum_SO":"Belum SO","Progres_Val": st.column_config.ProgressColumn("Progres", format="%.2f", min_value=0, max_value=1)}, hide_index=True, use_container_width=True)
 
         # Progress AS (Sorted Lowest)
         st.write("### 📊 Progres SO PER AS (Urutan Terendah di Atas)")
-        as_sum = df_u.groupby('AS').agg(Target_Toko_SO=('KDTOKO', 'count'), Sudah_SO=('STATUS', 'sum')).reset_index()
-        as_sum['Belum_SO'] = as_sum['Target_Toko_SO'] - as_sum['Sudah_SO']
-        as_sum['Progres_Val'] = (as_sum['Sudah_SO'] / as_sum['Target_Toko_SO']).round(2)
-        st.dataframe(as_sum.sort_values('Progres_Val'), column_config={"Target_Toko_SO":"Target Toko SO","Sudah_SO":"Sudah SO","Belum_SO":"Belum SO","Progres_Val": st.column_config.ProgressColumn("Progres", format="%.2f", min_value=0, max_value=1)}, hide_index=True, use_container_width=True)
+        st.dataframe(snap_prog['as_sum'], column_config={"Target_Toko_SO":"Target Toko SO","Sudah_SO":"Sudah SO","Belum_SO":"Belum SO","Progres_Val": st.column_config.ProgressColumn("Progres", format="%.2f", min_value=0, max_value=1)}, hide_index=True, use_container_width=True)
 
         st.write("---")
-        df_belum_all = df_u[df_u['STATUS'] == 0].copy()
         
         # Expander AM (Skrip Inti)
         with st.expander("🔍 Detail Toko Belum SO Per AM"):
-            if not df_belum_all.empty:
-                list_am_belum = sorted(df_belum_all['AM'].unique())
-                sel_am_det = st.selectbox("Pilih Area Manager (AM):", options=list_am_belum, key="sel_am_det")
-                df_det_am = df_belum_all[df_belum_all['AM'] == sel_am_det][['KDTOKO', 'NAMA TOKO']]
-                df_det_am.columns = ['Kode', 'Nama']
-                st.dataframe(df_det_am, hide_index=True, use_container_width=True)
+            if snap_prog['belum_am']:
+                sel_am_det = st.selectbox("Pilih Area Manager (AM):", options=list(snap_prog['belum_am']), key="sel_am_det")
+                st.dataframe(snap_prog['belum_am'][sel_am_det], hide_index=True, use_container_width=True)
             else: st.success("Semua toko sudah SO!")
 
         # Expander AS (Skrip Inti)
         with st.expander("🔍 Detail Toko Belum SO Per AS"):
-            if not df_belum_all.empty:
-                list_as_belum = sorted(df_belum_all['AS'].unique())
-                sel_as_det = st.selectbox("Pilih AS:", options=list_as_belum, key="sel_as_det")
-                df_det_as = df_belum_all[df_belum_all['AS'] == sel_as_det][['KDTOKO', 'NAMA TOKO']]
-                df_det_as.columns = ['Kode', 'Nama']
-                st.dataframe(df_det_as, hide_index=True, use_container_width=True)
+            if snap_prog['belum_as']:
+                sel_as_det = st.selectbox("Pilih AS:", options=list(snap_prog['belum_as']), key="sel_as_det")
+                st.dataframe(snap_prog['belum_as'][sel_as_det], hide_index=True, use_container_width=True)
             else: st.success("Semua toko sudah SO!")
 
     st.write("---")
@@ -236,12 +1488,12 @@ if st.session_state.page == "HOME":
         l_nik = st.text_input("NIK:", max_chars=10, key="l_nik")
         l_pw = st.text_input("Password:", type="password", key="l_pw")
         if st.button("LOG IN", type="primary", use_container_width=True):
-            db_login = get_user_db_safe()
-            if db_login and l_nik in db_login and db_login[l_nik] == l_pw:
-                clear_all_caches()
+            ok_login = get_user_index().check(l_nik, l_pw)  # 1 GET kecil objek NIK
+            if ok_login:
+                reset_session_state()
                 st.session_state.user_nik, st.session_state.page = l_nik, "USER_INPUT"
                 st.rerun()
-            elif db_login is None: st.error("Database user error. Mohon klik login kembali.")
+            elif ok_login is None: st.error("Database user error. Mohon klik login kembali.")
             else: st.error("NIK atau Password salah!")
         st.markdown(f'<a href="https://wa.me/6287725860048" target="_blank" style="text-decoration:none;"><button style="width:100%; background:transparent; color:white; border:1px solid white; border-radius:5px; cursor:pointer; padding:5px;">❓ Lupa Password? Hubungi Admin</button></a>', unsafe_allow_html=True)
     
@@ -251,131 +1503,198 @@ if st.session_state.page == "HOME":
         d_cpw = st.text_input("Konfirmasi Password:", type="password", key="d_cpw")
         if st.button("DAFTAR", use_container_width=True):
             if d_nik and d_pw == d_cpw:
-                db_reg = get_user_db_safe()
-                if db_reg and d_nik in db_reg: st.warning("NIK sudah ada.")
-                else:
-                    db_reg[d_nik] = d_pw
-                    if update_user_db(db_reg): st.success("Pendaftaran Berhasil!")
+                res_reg = get_user_index().update(d_nik, d_pw, create=True)
+                if res_reg == 'exists': st.warning("NIK sudah ada.")
+                elif res_reg == 'ok': st.success("Pendaftaran Berhasil!")
+                else: st.error("Database user sibuk/error. Mohon klik daftar kembali.")
             else: st.error("Password tidak cocok atau data tidak lengkap.")
     
     if st.button("🛡️ Admin Login", use_container_width=True): st.session_state.page = "ADMIN_AUTH"; st.rerun()
 
 # =================================================================
-# 4. ADMIN PANEL (FULL LOGIC & SUCCESS MESSAGES)
+# 5. ADMIN PANEL (FULL LOGIC & SUCCESS MESSAGES)
 # =================================================================
 elif st.session_state.page == "ADMIN_AUTH":
     pw_adm = st.text_input("Password Admin:", type="password")
     if st.button("Masuk Admin"):
-        if pw_adm == "icnkl034": clear_all_caches(); st.session_state.page = "ADMIN_PANEL"; st.rerun()
+        if pw_adm == "icnkl034": reset_session_state(); st.session_state.page = "ADMIN_PANEL"; st.rerun()
         else: st.error("Password Admin Salah!")
     if st.button("Kembali"): st.session_state.page = "HOME"; st.rerun()
 
 elif st.session_state.page == "ADMIN_PANEL":
     st.title("🛡️ Admin Panel")
-    tab_rek, tab_mas, tab_usr, tab_res = st.tabs(["📊 Rekap", "📤 Master", "👤 Kelola User", "🔥 Reset Hasil Input"])
+    tab_rek, tab_mas, tab_usr, tab_res, tab_perf = st.tabs(["📊 Rekap", "📤 Master", "👤 Kelola User", "🔥 Reset Hasil Input", "⏱️ Performa"])
     
     with tab_rek:
         df_m_rek, v_aktif_rek = get_master_data()
         target_v = st.text_input("Tarik Data Seri (MM-YYYY):", value=v_aktif_rek)
+        n_workers = st.number_input("Download paralel (file sekaligus):", min_value=1, max_value=32, value=REKAP_WORKERS)
+        c_fmt, c_split = st.columns(2)
+        fmt_rek = c_fmt.radio("Format:", ["xlsx", "zip"], horizontal=True,
+                              format_func=lambda x: "Excel (.xlsx)" if x == "xlsx" else "CSV (.zip)")
+        split_rek = c_split.checkbox("Pisah per AM (sheet / file per AM)")
         if st.button("📥 Download Gabungan (Full Master)", use_container_width=True):
             with st.spinner("Menggabungkan data..."):
-                res_rek = cloudinary.api.resources(resource_type="raw", type="upload", prefix="pareto_nkl/hasil/Hasil_")
-                filtered_rek = [f for f in res_rek.get('resources', []) if f"v{target_v}" in f['public_id']]
-                combined_in = pd.DataFrame(columns=['KDTOKO', 'PLU', 'KETERANGAN'])
-                if filtered_rek:
-                    inputs_rek = []
-                    for f in filtered_rek:
-                        try:
-                            df_t = pd.read_excel(f"{f['secure_url']}?t={int(time.time())}")
-                            df_t.columns = [str(c).upper().strip() for c in df_t.columns]
-                            inputs_rek.append(df_t[['KDTOKO', 'PLU', 'KETERANGAN']])
-                        except: pass
-                    if inputs_rek: combined_in = pd.concat(inputs_rek, ignore_index=True).drop_duplicates(subset=['KDTOKO', 'PLU'])
+                bar_rek = st.progress(0.0, text="Mengecek file hasil yang berubah...")
+                combined_in, failed_rek, stat_rek = refresh_rekap(
+                    target_v, n_workers,
+                    on_progress=lambda i, n: bar_rek.progress(i / n, text=f"Membaca file hasil berubah {i}/{n}")
+                )
+                bar_rek.empty()
+                st.info(f"📂 {stat_rek['total']} file hasil: {stat_rek['downloaded']} dibaca ulang, {stat_rek['removed']} dihapus dari rekap.")
+                if failed_rek:
+                    st.warning(f"⚠️ {len(failed_rek)} file gagal diproses (file lama yang gagal dibaca memakai isi rekap sebelumnya).")
+                    with st.expander("Detail file gagal"):
+                        st.dataframe(pd.DataFrame(failed_rek), hide_index=True, use_container_width=True)
                 
-                m_cols = list(df_m_rek.columns)
-                df_m_mrg = df_m_rek.drop(columns=['KETERANGAN']) if 'KETERANGAN' in df_m_rek.columns else df_m_rek.copy()
-                final_rekap = df_m_mrg.merge(combined_in, on=['KDTOKO', 'PLU'], how='left').fillna("")
-                final_rekap = final_rekap[m_cols if 'KETERANGAN' in m_cols else m_cols + ['KETERANGAN']]
-                out_rek = io.BytesIO()
-                with pd.ExcelWriter(out_rek) as w: final_rekap.to_excel(w, index=False)
-                st.download_button("📥 Klik Download", out_rek.getvalue(), f"Full_Rekap_{target_v}.xlsx")
+                key_rek = (target_v, stat_rek['fingerprint'], (get_master_meta() or {}).get('etag'), fmt_rek, split_rek)
+                path_rek = get_rekap_export(
+                    key_rek, lambda p: write_rekap_export(p, df_m_rek, combined_in, stat_rek['nl_implicit'], fmt_rek, split_rek), fmt_rek
+                )
+                # Tombol hanya dirender di run ini: file tidak dibaca ulang ke memori tiap rerun Admin Panel.
+                # Klik "Download Gabungan" lagi memakai file yang sama di disk selama isinya tidak berubah.
+                mime_rek = "application/zip" if fmt_rek == "zip" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                with open(path_rek, 'rb') as fh_rek:
+                    st.download_button("📥 Klik Download", fh_rek, f"Full_Rekap_{target_v}{'_per_AM' if split_rek else ''}.{fmt_rek}",
+                                       mime=mime_rek, use_container_width=True)
 
     with tab_mas:
         # Cek status master untuk pesan dinamis
         master_aktif_exists = False
-        try:
-            cloudinary.api.resource(MASTER_PATH, resource_type="raw")
-            master_aktif_exists = True
+        try: master_aktif_exists = any(get_storage().stat(p) is not None for p in (MASTER_CATALOG, MASTER_PATH))
         except: pass
 
         f_up = st.file_uploader("Upload Master Tambahan (.xlsx)", type=["xlsx"])
         if f_up and st.button("🚀 Update Master"):
             with st.spinner("Validating & Uploading..."):
                 # KOMPENSASI: Proteksi format kolom master
-                new_master_test = pd.read_excel(f_up)
+                with trace("master.read_excel(upload)", f_up.size):
+                    new_master_test = pd.read_excel(f_up)
                 req_fields = ['KDTOKO','AM','AS','PLU','RUPIAH']
                 if not all(field in [str(c).strip().upper() for c in new_master_test.columns] for field in req_fields):
                     st.error("⚠️ Format kolom Excel salah! Pastikan ada kolom KDTOKO, AM, AS, PLU, RUPIAH.")
                 else:
-                    old_df_m, _ = get_master_data()
-                    new_master_test.columns = [str(c).strip().upper() for c in new_master_test.columns]
-                    final_m = pd.concat([old_df_m, new_master_test], ignore_index=True).drop_duplicates(subset=['KDTOKO', 'PLU'], keep='last')
-                    if 'KETERANGAN' in final_m.columns: final_m['KETERANGAN'] = ""
-                    buf_m = io.BytesIO()
-                    with pd.ExcelWriter(buf_m) as w: final_m.to_excel(w, index=False)
-                    cloudinary.uploader.upload(buf_m.getvalue(), resource_type="raw", public_id=MASTER_PATH, overwrite=True, invalidate=True)
+                    new_master_test = normalize_master_frame(new_master_test)
+                    # Hanya shard AM yang tersentuh upload yang ditulis ulang (bukan seluruh master)
+                    with trace("master.publish"):
+                        res_m = update_master_partitions(new_master_test)
                     # Pesan Dinamis
-                    if master_aktif_exists: st.success("✅ Master sukses diperbarui")
+                    if master_aktif_exists: st.success(f"✅ Master sukses diperbarui ({res_m['written']} dari {res_m['parts']} shard AM ditulis ulang)")
                     else: st.success("✅ Master baru berhasil diupload")
-                    clear_all_caches(); time.sleep(2); st.rerun()
+                    invalidate_master(); reset_session_state(); time.sleep(2); st.rerun()
 
         st.divider()
         st.subheader("🗑️ Hapus Master Aktif")
         opsi_del_h = st.checkbox("Ikut hapus hasil input user?")
         if st.button("🔥 Eksekusi Hapus Master", type="primary"):
-            cloudinary.uploader.destroy(MASTER_PATH, resource_type="raw")
+            storage = get_storage()
+            storage.delete([MASTER_PATH])
+            for prefix_m in (f"{MASTER_PART_DIR}/", f"{MASTER_SNAPSHOT_DIR}/"):
+                try: storage.delete_prefix(prefix_m)
+                except: pass
             if opsi_del_h:
-                res_all = cloudinary.api.resources(resource_type="raw", type="upload", prefix="pareto_nkl/hasil/")
-                pids_all = [f['public_id'] for f in res_all.get('resources', [])]
-                if pids_all: cloudinary.api.delete_resources(pids_all, resource_type="raw")
-            clear_all_caches(); st.success("Master Terhapus!"); time.sleep(2); st.rerun()
+                bar_del = st.progress(0.0, text="Menghapus hasil input...")
+                res_del = prune_results(on_progress=lambda i, n: bar_del.progress(i / n, text=f"Menghapus batch {i}/{n}"))
+                bar_del.empty()
+                if res_del['failures']:
+                    st.error(f"⚠️ {len(res_del['failures'])} batch gagal dihapus, ulangi untuk membersihkan sisanya.")
+                    st.dataframe(pd.DataFrame(res_del['failures']), hide_index=True, use_container_width=True)
+                    invalidate_master(); st.stop()
+            invalidate_master(); reset_session_state(); st.success("Master Terhapus!"); time.sleep(2); st.rerun()
 
     with tab_usr:
         st.subheader("Reset Password User")
         nik_man = st.text_input("Ketik NIK User:")
-        db_usr_adm = get_user_db_safe()
-        if nik_man and db_usr_adm and nik_man in db_usr_adm:
+        try: found_adm = bool(nik_man) and get_user_index().password(nik_man) is not None
+        except: found_adm = False
+        if found_adm:
             st.success(f"User {nik_man} ditemukan")
             p_new = st.text_input("Password Baru:", type="password")
             if st.button("Update Sekarang"):
-                db_usr_adm[nik_man] = p_new
-                if update_user_db(db_usr_adm): st.success("Reset Password Sukses!"); time.sleep(2); st.rerun()
+                if get_user_index().update(nik_man, p_new) == 'ok': st.success("Reset Password Sukses!"); time.sleep(2); st.rerun()
+                else: st.error("Gagal menyimpan, coba lagi.")
         elif nik_man: st.error("NIK tidak ditemukan.")
 
+        st.divider()
+        st.subheader("🗂️ Migrasi Database User")
+        st.caption("Pecah file user lama (1 JSON) ke shard per awalan NIK. Shard yang sudah ada tidak ditimpa.")
+        if st.button("Migrasi Sekarang"):
+            try: st.success(f"✅ {get_user_index().migrate_legacy()} shard user ditulis.")
+            except Exception as e: st.error(f"Migrasi gagal: {e}")
+        if st.button("Bangun Ulang Index User"):
+            try: st.success(f"✅ Index dibangun ulang: {get_user_index().rebuild_index()} user.")
+            except Exception as e: st.error(f"Gagal: {e}")
+
     with tab_res:
         st.warning("Reset Folder Hasil Input")
+        mode_res = st.radio("Cakupan:", ["Semua seri", "Sisakan satu seri (hapus seri lama)"], horizontal=True)
+        keep_res = ()
+        if mode_res != "Semua seri":
+            keep_res = (st.text_input("Seri yang disimpan (MM-YYYY):", value=current_series(), key="v_keep_res").strip(),)
         if st.button("🔥 RESET HASIL INPUT TANPA HAPUS MASTER", type="primary"):
-            res_res = cloudinary.api.resources(resource_type="raw", type="upload", prefix="pareto_nkl/hasil/")
-            pids_res = [f['public_id'] for f in res_res.get('resources', [])]
-            if pids_res: cloudinary.api.delete_resources(pids_res, resource_type="raw")
-            clear_all_caches(); st.success("Dibersihkan!"); time.sleep(2); st.rerun()
+            if keep_res and not SERIES_RE.match(keep_res[0]): st.error("Seri yang disimpan harus berformat MM-YYYY (mis. 05-2026)."); st.stop()
+            bar_res = st.progress(0.0, text="Membaca daftar file hasil...")
+            try: res_res = prune_results(keep_res, on_progress=lambda i, n: bar_res.progress(i / n, text=f"Menghapus batch {i}/{n}"))
+            except ValueError as e: bar_res.empty(); st.error(f"⚠️ {e}"); st.stop()
+            bar_res.empty()
+            if res_res['failures']:
+                st.error(f"⚠️ {res_res['deleted']}/{res_res['found']} file terhapus, {len(res_res['failures'])} batch gagal. Ulangi untuk membersihkan sisanya.")
+                st.dataframe(pd.DataFrame(res_res['failures']), hide_index=True, use_container_width=True)
+            else:
+                seri_res = ", ".join(res_res['series']) or "-"
+                reset_session_state(); st.success(f"Dibersihkan! {res_res['deleted']} file (seri: {seri_res})"); time.sleep(2); st.rerun()
+
+        st.divider()
+        st.subheader("🔧 Perbaikan Progres")
+        v_fix = st.text_input("Seri progres (MM-YYYY):", value=datetime.now().strftime("%m-%Y"), key="v_fix_prog")
+        if st.button("🔧 Rebuild Manifest Progres dari Folder Hasil"):
+            with st.spinner("Membaca seluruh folder hasil..."):
+                man_fix = rebuild_progress_manifest(v_fix)
+            st.success(f"✅ Manifest seri {v_fix} dibangun ulang: {len(man_fix['stores'])} toko selesai.")
+
+    with tab_perf:
+        st.subheader("⏱️ Latensi Hot Path (proses ini)")
+        st.caption(f"{PERF_BUFFER_SIZE} event terakhir sejak server start / reset. Waktu dalam milidetik.")
+        perf_sum = PERF.summary()
+        if perf_sum.empty: st.info("Belum ada operasi tercatat.")
+        else:
+            st.dataframe(perf_sum, column_config={
+                "op": "Operasi", "count": "Jumlah", "p50_ms": st.column_config.NumberColumn("p50 (ms)", format="%.1f"),
+                "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.1f"), "max_ms": st.column_config.NumberColumn("Max (ms)", format="%.1f"),
+                "bytes": "Bytes", "errors": "Error",
+            }, hide_index=True, use_container_width=True)
+            perf_err = PERF.events().dropna(subset=['error']).tail(20)
+            if not perf_err.empty:
+                with st.expander(f"⚠️ Error terakhir ({len(perf_err)})"):
+                    st.dataframe(perf_err.assign(ts=pd.to_datetime(perf_err['ts'], unit='s')), hide_index=True, use_container_width=True)
+        snap_err = get_progress_service().last_error
+        if snap_err: st.warning(f"Refresh snapshot progres terakhir gagal: {snap_err}")
+        c_p1, c_p2 = st.columns(2)
+        with c_p1:
+            # JSON hanya dibangun saat diminta, bukan di setiap rerun Admin Panel
+            if st.button("🧾 Siapkan Export JSON", use_container_width=True):
+                st.download_button("📥 Download JSON", PERF.export_json(master=get_master_meta(), backend=STORAGE_BACKEND),
+                                   f"perf_{datetime.now():%Y%m%d_%H%M%S}.json", mime="application/json", use_container_width=True)
+        with c_p2:
+            if st.button("🧹 Reset Statistik", use_container_width=True): PERF.clear(); st.rerun()
 
     if st.button("🚪 Logout Admin", use_container_width=True):
-        clear_all_caches(); st.session_state.page = "HOME"; st.rerun()
+        reset_session_state(); st.session_state.page = "HOME"; st.rerun()
 
 # =================================================================
-# 5. USER INPUT (NK/NL SEPARATION & SUCCESS ANIMATION)
+# 6. USER INPUT (NK/NL SEPARATION & SUCCESS ANIMATION)
 # =================================================================
 elif st.session_state.page == "USER_INPUT":
     st.title("📋 Input Pareto")
-    df_m_in, v_master_in = get_master_data()
-    if not df_m_in.empty:
-        sel_am_in = st.selectbox("1. PILIH AM:", sorted(df_m_in['AM'].unique()))
-        df_f_am_in = df_m_in[df_m_in['AM'] == sel_am_in]
-        sel_nama_in = st.selectbox("2. PILIH NAMA TOKO:", sorted(df_f_am_in['NAMA TOKO'].unique()))
-        df_sel_in = df_f_am_in[df_f_am_in['NAMA TOKO'] == sel_nama_in]
+    idx_in, v_master_in = get_master_index(), current_series()
+    if idx_in is not None and idx_in['am_list']:  # Master tanpa baris / katalog tanpa shard -> halaman kosong
+        # Lookup dict dari index bersama (tanpa filter full master tiap rerun)
+        sel_am_in = st.selectbox("1. PILIH AM:", idx_in['am_list'])
+        sel_nama_in = st.selectbox("2. PILIH NAMA TOKO:", idx_in['stores'].get(sel_am_in, []))
+        df_sel_in = get_store_rows(idx_in, sel_am_in, sel_nama_in) if sel_nama_in is not None else pd.DataFrame()
+        if df_sel_in is None: st.error("Gagal memuat data AM ini. Mohon coba lagi.")
         
-        if not df_sel_in.empty:
+        elif not df_sel_in.empty:
             v_kdtoko, v_as = str(df_sel_in['KDTOKO'].iloc[0]), str(df_sel_in['AS'].iloc[0])
             
             # Tombol Refresh UI (Skrip Inti)
@@ -384,16 +1703,16 @@ elif st.session_state.page == "USER_INPUT":
             c2.metric("AS:", v_as)
             with c3:
                 if st.button("🔄 Refresh", key="btn_refresh_user"):
-                    clear_all_caches(); st.rerun()
+                    reset_session_state(); st.rerun()  # Cache hasil sesi ini dibuang -> dicek ulang
 
-            # Verifikasi Fisik Cloud (Skrip Inti)
+            # Hasil tersimpan (cache sesi; dicek ulang hanya setelah toko ini disimpan)
+            queue_in = get_save_queue()
+            status_in = queue_in.status(v_kdtoko, v_master_in)
             existing_res = get_existing_result(v_kdtoko, v_master_in)
-            if existing_res is not None:
-                if not validate_file_exists_in_cloudinary(v_kdtoko, v_master_in):
-                    existing_res = None
+            if status_in and status_in['state'] != 'saved':
+                existing_res = status_in['frame']  # Isian yang belum/gagal terupload tetap tampil
             
-            data_final_in = df_sel_in.copy()
-            data_final_in['PLU'] = data_final_in['PLU'].astype(str).str.strip()
+            data_final_in = df_sel_in.copy()  # PLU/DESC/QTY/RUPIAH sudah dikoersi di index
 
             if existing_res is not None:
                 cloud_dat = existing_res[['PLU', 'KETERANGAN']].copy()
@@ -403,12 +1722,7 @@ elif st.session_state.page == "USER_INPUT":
                 st.success(f"✅ Sinkronisasi Berhasil: Isian lama Seri {v_master_in} dimuat.")
             else: data_final_in['KETERANGAN'] = ""
 
-            data_final_in['KETERANGAN'] = data_final_in['KETERANGAN'].fillna("")
-            for col in ['PLU', 'DESC', 'KETERANGAN']: 
-                data_final_in[col] = data_final_in[col].astype(str).replace(['nan','NaN','None'], '')
-            # FIX: Force Numeric Murni untuk QTY & RUPIAH
-            for col in ['QTY', 'RUPIAH']: 
-                data_final_in[col] = pd.to_numeric(data_final_in[col], errors='coerce').fillna(0)
+            data_final_in['KETERANGAN'] = data_final_in['KETERANGAN'].fillna("").astype(str).replace(['nan','NaN','None'], '')
 
             # --- PEMISAHAN NK DAN NL (Permintaan Baru) ---
             df_nk = data_final_in[data_final_in['RUPIAH'] < 0].copy()
@@ -437,24 +1751,15 @@ elif st.session_state.page == "USER_INPUT":
                 if edited_nk['KETERANGAN'].apply(lambda x: str(x).strip() == "").any():
                     st.error("⚠️ Semua kolom KETERANGAN item MINUS (NK) wajib diisi!")
                 else:
-                    with st.spinner("Menyimpan..."):
-                        df_nk['KETERANGAN'] = edited_nk['KETERANGAN'].values
-                        df_nl['KETERANGAN'] = "ini item nl!" # Otomasi Keterangan NL
-                        
-                        combined_save = pd.concat([df_nk, df_nl], ignore_index=True)
-                        orig_m_cols = [c for c in df_m_in.columns if c != 'KETERANGAN']
-                        final_out = combined_save[orig_m_cols + ['KETERANGAN']]
-                        
-                        buf_s = io.BytesIO()
-                        with pd.ExcelWriter(buf_s) as w: final_out.to_excel(w, index=False)
-                        cloudinary.uploader.upload(buf_s.getvalue(), resource_type="raw", public_id=f"pareto_nkl/hasil/Hasil_{v_kdtoko}_v{v_master_in}.xlsx", overwrite=True, invalidate=True)
-                        
-                        # ANIMASI & PESAN SUKSES (Permintaan Baru)
-                        st.balloons()
-                        st.success("✅ Input keterangan sukses!")
-                        time.sleep(2)
-                        clear_all_caches()
-                        st.rerun()
+                    # Write-behind: upload jalan di latar, klik ganda hanya menimpa antrian toko ini
+                    df_nk['KETERANGAN'] = edited_nk['KETERANGAN'].values
+                    queue_in.submit(df_nk, v_kdtoko, v_master_in, df_nl['PLU'])
+                    st.session_state['save_wait'] = v_kdtoko  # Sukses baru ditampilkan setelah upload selesai
+                    reset_session_state()
+                    st.rerun()
+
+            busy_in = status_in is not None and status_in['state'] in ('pending', 'saving')
+            st.fragment(run_every=SAVE_POLL_SEC if busy_in else None)(save_status_panel)(queue_in, v_kdtoko, v_master_in, busy_in)
 
     if st.button("🚪 Keluar (Logout)", use_container_width=True): 
-        clear_all_caches(); st.session_state.page = "HOME"; st.rerun()
+        reset_session_state(); st.session_state.page = "HOME"; st.rerun()
@@ -0,0 +1,159 @@
+"""Benchmark hot path Pareto NKL secara offline (backend storage lokal, tanpa Cloudinary).
+
+Membuat master sintetis (default 2.000 toko x 40 PLU) + file hasil untuk sebagian toko,
+lalu mengukur get_master_data, get_progress_data, rekap merge + export, simpan 1 toko dan
+update master terpartisi per AM memakai fungsi core asli dari app.py (dijalankan lewat streamlit AppTest).
+
+Contoh:
+    python benchmark.py --stores 2000 --plu 40 --done 0.6 --latency 0.02 > bench_output.txt
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+ROUTING_MARKER = "# 4. ROUTING & HOME"
+# Harus sama dengan konstanta path di app.py
+MASTER_PATH = "pareto_nkl/master_pareto_nkl.xlsx"
+HASIL_DIR = "pareto_nkl/hasil"
+
+
+def build_master(n_stores, n_plu, n_am=20, seed=7):
+    """Master sintetis: setengah PLU per toko NK (rupiah minus), setengah NL"""
+    rng = np.random.default_rng(seed)
+    kd = np.repeat([f"T{i:04d}" for i in range(n_stores)], n_plu)
+    store_idx = np.repeat(np.arange(n_stores), n_plu)
+    rupiah = rng.integers(1_000, 5_000_000, size=len(kd)).astype(float)
+    rupiah[np.tile(np.arange(n_plu) < n_plu // 2, n_stores)] *= -1
+    return pd.DataFrame({
+        'KDTOKO': kd,
+        'NAMA TOKO': [f"TOKO {k}" for k in kd],
+        'AM': [f"AM {i % n_am:02d}" for i in store_idx],
+        'AS': [f"AS {i % (n_am * 3):02d}" for i in store_idx],
+        'PLU': np.tile(np.arange(10_000_000, 10_000_000 + n_plu), n_stores),
+        'DESC': [f"ITEM {p}" for p in np.tile(np.arange(n_plu), n_stores)],
+        'QTY': rng.integers(-50, 50, size=len(kd)),
+        'RUPIAH': rupiah,
+        'KETERANGAN': "",
+    })
+
+
+def seed_storage(root, df_master, series, done_ratio, legacy_xlsx=False):
+    """Tulis master + file hasil toko yang 'sudah SO' (delta .json atau xlsx lama) ke folder storage lokal"""
+    def write(path, data):
+        fp = os.path.join(root, *path.split('/'))
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        with open(fp, 'wb') as fh: fh.write(data)
+
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf) as w: df_master.to_excel(w, index=False)
+    write(MASTER_PATH, buf.getvalue())
+
+    stores = df_master['KDTOKO'].unique()
+    for kd in stores[:int(len(stores) * done_ratio)]:
+        df_t = df_master[df_master['KDTOKO'] == kd].copy()
+        if legacy_xlsx:
+            df_t['KETERANGAN'] = np.where(df_t['RUPIAH'] < 0, "selisih stok", "ini item nl!")
+            buf = io.BytesIO()
+            with pd.ExcelWriter(buf) as w: df_t.to_excel(w, index=False)
+            write(f"{HASIL_DIR}/Hasil_{kd}_v{series}.xlsx", buf.getvalue())
+        else:
+            nk = df_t[df_t['RUPIAH'] < 0]
+            write(f"{HASIL_DIR}/Hasil_{kd}_v{series}.json", json.dumps({
+                'schema': 1, 'kdtoko': kd, 'series': series, 'columns': ['PLU', 'KETERANGAN'],
+                'rows': [[str(p), "selisih stok"] for p in nk['PLU']],
+                'nl': [str(p) for p in df_t.loc[df_t['RUPIAH'] >= 0, 'PLU']],
+            }).encode())
+
+
+BENCH_SCRIPT = '''
+import time as _bench_time
+_bench = []
+
+def _timeit(name, fn, *args, repeat=1):
+    for _ in range(repeat):
+        t0 = _bench_time.perf_counter()
+        out = fn(*args)
+        _bench.append((name, _bench_time.perf_counter() - t0))
+    return out
+
+st.cache_data.clear()
+_df_m, _v = _timeit("get_master_data (cold)", get_master_data)
+_timeit("get_master_data (warm)", get_master_data, repeat=5)
+_timeit("get_progress_data", get_progress_data, _df_m, _v, repeat=3)
+_timeit("get_progress_snapshot (cold)", get_progress_snapshot)
+_timeit("get_progress_snapshot (warm)", get_progress_snapshot, repeat=5)
+_idx = _timeit("get_master_index (build)", get_master_index)
+_timeit("get_master_index (warm)", get_master_index, repeat=5)
+_timeit("store lookup (index)", get_store_rows, _idx, _idx['am_list'][-1], _idx['stores'][_idx['am_list'][-1]][-1], repeat=5)
+_timeit("refresh_rekap (full)", refresh_rekap, _v)
+_rekap = _timeit("refresh_rekap (incremental)", refresh_rekap, _v)
+_timeit("build_rekap_frame", build_rekap_frame, _df_m, _rekap[0], _rekap[2]['nl_implicit'])
+_exp_dir = tempfile.mkdtemp(prefix="pareto_bench_export_")
+for _fmt in ("xlsx", "zip"):
+    _timeit(f"write_rekap_export ({_fmt})", write_rekap_export, os.path.join(_exp_dir, f"rekap.{_fmt}"),
+            _df_m, _rekap[0], _rekap[2]['nl_implicit'], _fmt)
+_kd = _df_m['KDTOKO'].iloc[-1]
+_rows = _df_m[_df_m['KDTOKO'] == _kd].copy()
+_nk = _rows[_rows['RUPIAH'] < 0].copy()
+_nk['KETERANGAN'] = "benchmark"
+_timeit("save_store_result", save_store_result, _nk, _kd, _v, _rows.loc[_rows['RUPIAH'] >= 0, 'PLU'], repeat=3)
+# Master terpartisi per AM: migrasi dari xlsx, lalu update 1 AM (hanya shard itu ditulis ulang)
+_upd = _df_m[_df_m['AM'] == _df_m['AM'].iloc[0]].copy()
+_timeit("update_master_partitions (migrate)", update_master_partitions, _upd)
+_upd['RUPIAH'] = _upd['RUPIAH'] - 1
+_timeit("update_master_partitions (1 AM)", update_master_partitions, _upd)
+invalidate_master()
+_pidx = _timeit("get_master_index (catalog)", get_master_index)
+_pam = _pidx['am_list'][-1]
+_timeit("store lookup (AM shard)", get_store_rows, _pidx, _pam, _pidx['stores'][_pam][-1], repeat=5)
+_timeit("get_master_data (partitioned, cold)", get_master_data)
+st.session_state["bench"] = _bench
+'''
+
+
+def run(args):
+    with open(APP_PATH, encoding='utf-8') as fh: src = fh.read()
+    core_src = src[:src.index(ROUTING_MARKER)]
+
+    root = tempfile.mkdtemp(prefix="pareto_bench_")
+    try:
+        series = time.strftime("%m-%Y")
+        t0 = time.perf_counter()
+        seed_storage(root, build_master(args.stores, args.plu), series, args.done, args.legacy_xlsx)
+        print(f"# seed: {args.stores} toko x {args.plu} PLU, {args.done:.0%} sudah SO ({time.perf_counter() - t0:.1f}s)")
+
+        os.environ.update({"PARETO_STORAGE": "local", "PARETO_STORAGE_DIR": root, "PARETO_STORAGE_LATENCY": str(args.latency)})
+        at = AppTest.from_string(core_src + BENCH_SCRIPT, default_timeout=args.timeout)
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+        rows = pd.DataFrame(at.session_state["bench"], columns=["op", "sec"])
+        summary = rows.groupby("op", sort=False)["sec"].agg(["count", "mean", "min", "max"])
+        print(f"# latency storage: {args.latency * 1000:.0f} ms/operasi")
+        print(summary.to_string(float_format=lambda x: f"{x:.4f}"))
+        if args.json:
+            with open(args.json, 'w') as fh: json.dump(summary.reset_index().to_dict('records'), fh, indent=2)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--stores", type=int, default=2000)
+    ap.add_argument("--plu", type=int, default=40)
+    ap.add_argument("--done", type=float, default=0.6, help="porsi toko yang sudah punya file hasil")
+    ap.add_argument("--legacy-xlsx", action="store_true", help="file hasil format xlsx lama, bukan delta .json")
+    ap.add_argument("--latency", type=float, default=0.0, help="latensi buatan per operasi storage (detik)")
+    ap.add_argument("--timeout", type=float, default=1800)
+    ap.add_argument("--json", help="simpan ringkasan ke file JSON")
+    run(ap.parse_args())